@@ -1,3 +1,8 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
 import jwt
 from django.utils.translation import gettext_lazy as _
 from jwt import InvalidAlgorithmError, InvalidTokenError, PyJWKClient, algorithms
@@ -14,6 +19,69 @@ ALLOWED_ALGORITHMS = (
 )
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified token payloads keyed by a hash of the raw token.
+    Entries are dropped once their 'exp' claim passes or after `ttl` seconds,
+    whichever comes first.
+    """
+
+    def __init__(self, maxsize, ttl, leeway=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.leeway = leeway
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).digest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(payload)
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, key, payload):
+        now = time.time()
+        expires_at = now + self.ttl
+        if "exp" in payload:
+            try:
+                expires_at = min(expires_at, float(payload["exp"]) + self.leeway)
+            except (TypeError, ValueError):
+                return
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[key] = (dict(payload), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
 class TokenBackend:
     def __init__(
             self,
@@ -24,6 +92,8 @@ class TokenBackend:
             issuer=None,
             jwk_url: str = None,
             leeway=0,
+            cache_size=0,
+            cache_ttl=timedelta(minutes=5),
     ):
         self._validate_algorithm(algorithm)
 
@@ -40,6 +110,14 @@ class TokenBackend:
         else:
             self.verifying_key = verifying_key
 
+        self.verified_cache = None
+        if cache_size:
+            if isinstance(leeway, timedelta):
+                leeway = leeway.total_seconds()
+            if isinstance(cache_ttl, timedelta):
+                cache_ttl = cache_ttl.total_seconds()
+            self.verified_cache = VerifiedTokenCache(cache_size, cache_ttl, leeway)
+
     def _validate_algorithm(self, algorithm):
         """
         Ensure that the nominated algorithm is recognized, and that cryptography is installed for those
@@ -66,6 +144,12 @@ class TokenBackend:
 
         return self.verifying_key
 
+    def cache_info(self):
+        """Hit/miss counters of the verified token cache, or None when it is disabled"""
+        if self.verified_cache is None:
+            return None
+        return self.verified_cache.info()
+
     def encode(self, payload):
         """
         Returns an encoded token for the given payload dictionary.
@@ -89,7 +173,21 @@ class TokenBackend:
         dictionary.
         Raises a `TokenBackendError` if the token is malformed, if its
         signature check fails, or if its 'exp' claim indicates it has expired.
+        Verified payloads are served from `verified_cache` when it is enabled.
         """
+        cache_key = None
+        if verify and self.verified_cache is not None:
+            cache_key = self.verified_cache.make_key(token)
+            payload = self.verified_cache.get(cache_key)
+            if payload is not None:
+                return payload
+
+        payload = self._decode(token, verify)
+        if cache_key is not None:
+            self.verified_cache.set(cache_key, payload)
+        return payload
+
+    def _decode(self, token, verify):
         try:
             return jwt.decode(
                 token,
@@ -0,0 +1,78 @@
+import asyncio
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .metrics import GROUP_SEND_DURATION
+from .protocol import encode_binary, encode_text
+from .replay import record_event
+
+GAME_ROOM = 'game_room'
+
+
+def room_group(shard):
+    """Channel group of one shard of the game room"""
+    return f'{GAME_ROOM}_{shard}'
+
+
+def room_group_for(user_id):
+    """Shard group a user's sockets join; stable for a given user"""
+    return room_group(user_id % settings.GAME_ROOM_SHARDS)
+
+
+def user_group(user_id):
+    """Channel group holding every socket of one user"""
+    return f'user_{user_id}'
+
+
+def build_event(event_type, payload):
+    """
+    Build a channel-layer event whose client frame is encoded once here, in
+    both the JSON and MessagePack protocols, so every consumer in the group
+    can forward it without re-serializing.
+    """
+    message = {'type': event_type, **payload}
+    return {
+        'type': event_type,
+        'text': encode_text(message),
+        'bytes': encode_binary(message),
+    }
+
+
+async def group_send(channel_layer, group, event):
+    """`group_send` recording its latency"""
+    with GROUP_SEND_DURATION.time(event=event['type']):
+        await channel_layer.group_send(group, event)
+
+
+async def room_broadcast(event_type, payload):
+    """
+    Send a pre-encoded event to every socket in the game room. The shard
+    groups are published concurrently, so the fan-out is spread over the
+    channel layer's Redis hosts and over the nodes holding the sockets.
+    The event is tagged with its `seq` and kept for replay on `resume`. The
+    number is taken before sending, so concurrent broadcasts may reach a
+    socket out of `seq` order; clients reorder them (see `handle_resume`).
+    """
+    seq = await sync_to_async(record_event, thread_sensitive=False)({'type': event_type, **payload})
+    if seq is not None:
+        payload = {**payload, 'seq': seq}
+    event = build_event(event_type, payload)
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*(
+        group_send(channel_layer, room_group(shard), event)
+        for shard in range(settings.GAME_ROOM_SHARDS)
+    ))
+
+
+def broadcast(event_type, payload):
+    """Synchronous variant of `room_broadcast` for views and the session manager"""
+    async_to_sync(room_broadcast)(event_type, payload)
+
+
+async def send_to_users(event_type, payloads):
+    """Send each user in `payloads` (user id -> payload) their own event"""
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*(
+        group_send(channel_layer, user_group(user_id), build_event(event_type, payload))
+        for user_id, payload in payloads.items()
+    ))
@@ -1,225 +1,245 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .token import UntypedToken
 from .exceptions import InvalidToken, TokenError
 from django.contrib.auth.models import AnonymousUser
 from .models import GameSession, GameParticipation
+from . import fastjson, session_cache
+from .metrics import WEBSOCKET_CONNECTIONS, WEBSOCKET_MESSAGE_DURATION
+from .profiling import log_query_profile
+from .replay import events_since
+from .protocol import MESSAGE_TYPES, MSGPACK_SUBPROTOCOL, decode_binary, encode_binary, encode_text, epoch_ms
+from .selections import buffer_selection
+from .user_cache import get_cached_user
+from .broadcast import room_group_for, user_group
+from .counters import announce_join, count_participant, get_live_counts, live_player_count
 from .utils import game_session_manager, end_session_and_create_new, update_user_stats_for_session
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Count
 from asgiref.sync import sync_to_async
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from redis.exceptions import RedisError
 
 
 class GameConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.room_group_name = 'game_room'
+    binary = False
 
+    async def connect(self):
         # Authenticate user
         self.user = await self.get_user_from_token()
         if self.user is None or self.user.is_anonymous:
             await self.close()
             return
 
-        # Join room group
+        # Join the user's room shard and their own group for personal results
+        self.room_group_name = room_group_for(self.user.id)
+        self.user_group_name = user_group(self.user.id)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
+        # Clients asking for the MessagePack subprotocol get binary frames, others keep JSON
+        self.binary = MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await self.accept(MSGPACK_SUBPROTOCOL if self.binary else None)
+        WEBSOCKET_CONNECTIONS.inc()
 
         # Send current session info
         session_data = await self.get_current_session()
         if session_data:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'session_info',
                 'session': session_data
-            }))
+            })
 
     async def disconnect(self, close_code):
         # Leave room group
+        if not hasattr(self, 'user_group_name'):
+            return
+        WEBSOCKET_CONNECTIONS.dec()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = decode_binary(bytes_data) if bytes_data is not None else fastjson.loads(text_data)
+        except (ValueError, TypeError):
+            # TypeError: msgpack maps with unhashable keys
+            data = None
+        if not isinstance(data, dict):
+            await self.send_message({'type': 'error', 'message': 'Malformed message'})
+            return
         message_type = data.get('type')
-
-        if message_type == 'join_session':
-            await self.handle_join_session()
-        elif message_type == 'select_number':
-            # Parse request_details from the incoming message
-            number = data.get('number')
-            request_details = data.get('request_details', False)
-            await self.handle_select_number(number, request_details)
-        elif message_type == 'leave_session':
-            await self.handle_leave_session()
-        elif message_type == 'trigger_game_session_manager':
-            await self.handle_game_session_manager()
-        elif message_type == 'trigger_end_session':
-            await self.handle_end_session_and_create_new(data.get('session_id'))
-        elif message_type == 'trigger_update_user_stats':
-            await self.handle_update_user_stats(data.get('session_id'), data.get('winning_number'))
+        label = message_type if isinstance(message_type, str) and message_type in MESSAGE_TYPES else 'unknown'
+
+        with WEBSOCKET_MESSAGE_DURATION.time(type=label), \
+                log_query_profile('websocket_message', type=label, user_id=self.user.id):
+            if message_type == 'join_session':
+                await self.handle_join_session()
+            elif message_type == 'select_number':
+                # Parse request_details from the incoming message
+                number = data.get('number')
+                request_details = data.get('request_details', False)
+                await self.handle_select_number(number, request_details)
+            elif message_type == 'time_sync':
+                await self.handle_time_sync(data.get('client_time'))
+            elif message_type == 'resume':
+                await self.handle_resume(data.get('last_seq'))
+            elif message_type == 'get_snapshot':
+                await self.handle_get_snapshot()
+            elif message_type == 'leave_session':
+                await self.handle_leave_session()
+            elif message_type == 'trigger_game_session_manager':
+                await self.handle_game_session_manager()
+            elif message_type == 'trigger_end_session':
+                await self.handle_end_session_and_create_new(data.get('session_id'))
+            elif message_type == 'trigger_update_user_stats':
+                await self.handle_update_user_stats(data.get('session_id'), data.get('winning_number'))
 
     async def handle_join_session(self):
         """Handle user joining session"""
-        result = await self.join_user_to_session()
-        if result['success']:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'player_joined',
-                    'username': self.user.username,
-                    'player_count': result['player_count']
-                }
-            )
+        await self.join_user_to_session()
+
+    async def handle_time_sync(self, client_time):
+        """
+        Reply with the server clock, echoing the client's send time. From the
+        round trip the client estimates its clock offset and counts down to
+        session deadlines locally.
+        """
+        await self.send_message({
+            'type': 'time_sync_result',
+            'client_time': client_time,
+            'server_time': epoch_ms(),
+        })
+
+    async def handle_resume(self, last_seq):
+        """
+        Replay the room events sent after `last_seq`, the highest `seq` up to
+        which the client applied every event before reconnecting. Concurrent
+        broadcasts can arrive out of order, and live events may overlap the
+        replay, so clients apply events in `seq` order: they hold back an event
+        until the ones before it have arrived, drop the ones they have already
+        applied, and send `resume` again when a gap does not fill shortly.
+        If the missed events are gone, the client is told to resync from
+        session_info, get_snapshot and the history endpoints instead.
+        """
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0:
+            await self.send_message({'type': 'error', 'message': 'Invalid last_seq'})
+            return
+        try:
+            seq, messages = await sync_to_async(events_since, thread_sensitive=False)(last_seq)
+        except (RedisError, NotImplementedError):
+            seq, messages = None, None
+        if messages is None:
+            await self.send_message({'type': 'resume_result', 'resync': True, 'replayed': 0, 'seq': seq})
+            session_data = await self.get_current_session()
+            if session_data:
+                await self.send_message({'type': 'session_info', 'session': session_data})
+            return
+        for message in messages:
+            await self.send_message(message)
+        await self.send_message({'type': 'resume_result', 'resync': False, 'replayed': len(messages), 'seq': seq})
 
     async def handle_select_number(self, number, request_details=False):
         """Handle number selection"""
         if not number or not isinstance(number, int) or number < 1 or number > 10:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': 'Invalid number selection'
-            }))
+            })
             return
 
         # Always get the current session
-        session = await database_sync_to_async(GameSession.objects.get_current_active_session)()
+        session = await database_sync_to_async(session_cache.get_current_session)()
         if not session:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'No active session'}))
+            await self.send_message({'type': 'error', 'message': 'No active session'})
             return
 
-        # Helper to get or create participation and set selected_number and is_winner
-        @sync_to_async
-        def get_or_create_participation(user, session, number):
-            from .models import GameParticipation
-            winning_number = session.winning_number
-            is_winner = bool(winning_number and number == winning_number)
-            participation, created = GameParticipation.objects.get_or_create(
-                user=user,
-                session=session,
-                defaults={
+        if settings.GAME_SELECTION_WRITE_BEHIND and session.time_remaining > 0 and not request_details:
+            # Acknowledge right away; the pick is persisted when the session is settled
+            try:
+                created, _ = await sync_to_async(buffer_selection)(session, self.user.id, number)
+            except (RedisError, NotImplementedError):
+                # Without Redis the pick is written through below
+                created = None
+            if created is not None:
+                await database_sync_to_async(count_participant)(session, self.user.id, number)
+                if created:
+                    await database_sync_to_async(announce_join)(session, self.user.username)
+                await self.send_message({
+                    'type': 'number_selected',
+                    'success': True,
                     'selected_number': number,
-                    'is_winner': is_winner
-                }
-            )
-            if created:
-                session.player_count += 1
-                session.save()
-            else:
-                participation.selected_number = number
-                participation.is_winner = is_winner
-                participation.save()
-            return participation, created
-
-        # Ensure the user is a participant and set their number and is_winner
-        participation, created = await get_or_create_participation(self.user, session, number)
-        if created:
-            # Broadcast updated player count
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'player_joined',
-                    'username': self.user.username,
-                    'player_count': session.player_count
-                }
-            )
-
-        # Helper to get participations
-        @sync_to_async
-        def get_participations(session):
-            return list(session.participations.values('user__username', 'selected_number', 'is_winner'))
+                    'buffered': True,
+                })
+                return
 
-        # Helper to refresh session from db
-        @sync_to_async
-        def refresh_session(session):
-            session.refresh_from_db()
-            return session
+        # Join the session if needed and record the pick in one atomic upsert
+        result = await self.select_number_for_user(session, number)
+        if result.get('created'):
+            # Announce the new player with the next coalesced player_joined broadcast
+            await database_sync_to_async(announce_join)(session, self.user.username)
 
         if not session.is_active or session.time_remaining <= 0 or request_details:
-            winning_number = session.winning_number
-            participations = await get_participations(session)
-            winners = [p['user__username'] for p in participations if p['is_winner']]
-            your_participation = next((p for p in participations if p['user__username'] == self.user.username), None)
-            await self.send(text_data=json.dumps({
-                'type': 'session_result',
-                'winning_number': winning_number,
-                'participations': participations,
-                'winners': winners,
-                'your_participation': your_participation,
-            }))
+            snapshot = await self.get_session_snapshot(session)
+            await self.send_message({'type': 'session_result', **snapshot})
             return
-    
 
-        result = await self.select_number_for_user(number)
-        # After selection, return updated participations and session info
-        session = await refresh_session(session)
-        participations = await get_participations(session)
-        winners = [p['user__username'] for p in participations if p['is_winner']]
-        your_participation = next((p for p in participations if p['user__username'] == self.user.username), None)
-        print(f"your_participation: {your_participation}")
-        await self.send(text_data=json.dumps({
+        # Only the change and the per-number counts are sent back; see get_snapshot for the full picture
+        await self.send_message({
             'type': 'number_selected',
             'success': result['success'],
             'selected_number': number if result['success'] else None,
-            'participations': participations,
-            'winners': winners,
-            'your_participation': your_participation,
+            'your_participation': result.get('participation'),
+            'number_counts': await self.get_number_counts(session),
             'message': result.get('message', '')
-        }))
+        })
+
+    async def handle_get_snapshot(self):
+        """Send the full participation list of the current session on request"""
+        session = await database_sync_to_async(session_cache.get_current_session)()
+        if not session:
+            await self.send_message({'type': 'error', 'message': 'No active session'})
+            return
+        snapshot = await self.get_session_snapshot(session)
+        await self.send_message({'type': 'session_snapshot', **snapshot})
+
+    async def send_message(self, message):
+        """Send a message in the protocol negotiated for this connection"""
+        if self.binary:
+            await self.send(bytes_data=encode_binary(message))
+        else:
+            await self.send(text_data=encode_text(message))
 
     # WebSocket event handlers
-    async def session_countdown(self, event):
-        """Send countdown update"""
-        await self.send(text_data=json.dumps({
-            'type': 'session_countdown',
-            'time_left': event['time_left']
-        }))
-
-    async def session_ended(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session_ended',
-            'winning_number': event['winning_number'],
-            'winners': event['winners'],
-            'participations': event.get('participations', []),
-        }))
-
-    async def session_started(self, event):
-        """Send new session notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'session_started',
-            'session_id': str(event['session_id']),
-            'start_time': event['start_time']
-        }))
-
-    async def player_joined(self, event):
-        """Send player joined notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'player_joined',
-            'username': event['username'],
-            'player_count': event['player_count']
-        }))
-
-    async def game_result(self, event):
-        """Send game result"""
-        await self.send(text_data=json.dumps({
-            'type': 'game_result',
-            'winning_number': event['winning_number'],
-            'winners': event['winners'],
-            'is_winner': self.user.username in event.get('winners', [])
-        }))
-
-    async def session_result(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session_result',
-            'winning_number': event['winning_number'],
-            'winners': event['winners'],
-            'participations': event.get('participations', []),
-            'your_participation': event.get('your_participation'),
-        }))
+    async def forward_event(self, event):
+        """Forward a broadcast frame that was encoded once by the sender"""
+        frame = event.get('bytes' if self.binary else 'text')
+        if frame is None:
+            await self.send_message({key: value for key, value in event.items() if key not in ('text', 'bytes')})
+        elif self.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    session_countdown = forward_event
+    session_ended = forward_event
+    session_started = forward_event
+    player_joined = forward_event
+    session_result = forward_event
+    game_result = forward_event
+    selection_histogram = forward_event
 
     # Database operations
     @database_sync_to_async
@@ -243,7 +263,7 @@ class GameConsumer(AsyncWebsocketConsumer):
             validated_token = UntypedToken(token)
             user_id = validated_token['user_id']  # Adjust this if your claim is different
             User = get_user_model()
-            user = User.objects.get(id=user_id)
+            user = get_cached_user(user_id)
             return user
         except (InvalidToken, TokenError, KeyError, User.DoesNotExist):
             return AnonymousUser()
@@ -252,19 +272,20 @@ class GameConsumer(AsyncWebsocketConsumer):
     def get_current_session(self):
         """Get current active session data, including total users joined and user's total wins"""
         try:
-            session = GameSession.objects.get_current_active_session()
+            session = session_cache.get_current_session()
             if session:
                 # Count total users joined in this session
-                total_users_joined = session.participations.count()
+                total_users_joined = live_player_count(session)
                 # Get total wins for this user
                 user_wins = 0
                 if hasattr(self, 'user') and self.user and not self.user.is_anonymous:
                     if hasattr(self.user, 'game_stats'):
                         user_wins = self.user.game_stats.wins
                 return {
-                    'id': str(session.session_id),
+                    'id': session.session_id,
                     'time_remaining': session.time_remaining,
-                    'player_count': session.player_count,
+                    'deadline': epoch_ms(session.deadline),
+                    'player_count': total_users_joined,
                     'is_active': session.is_active,
                     'total_users_joined': total_users_joined,
                     'user_total_wins': user_wins
@@ -277,56 +298,73 @@ class GameConsumer(AsyncWebsocketConsumer):
     def join_user_to_session(self):
         """Add user to current session"""
         try:
-            session = GameSession.objects.get_current_active_session()
+            session = session_cache.get_current_session()
             if not session:
                 return {'success': False, 'message': 'No active session'}
 
-            return {
-                'success': True,
-                'player_count': session.player_count,
-            }
+            announce_join(session, self.user.username)
+            return {'success': True}
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
     @database_sync_to_async
-    def select_number_for_user(self, number):
-        """Select number for user in current session"""
+    def select_number_for_user(self, session, number):
+        """Select number for user in the given session, joining it first if needed"""
         try:
-            session = GameSession.objects.get_current_active_session()
-            if not session or not session.is_active:
-                return {'success': False, 'message': 'No active session'}
-
-            winning_number = session.winning_number
-            is_winner = bool(winning_number and number == winning_number)
-            participation, _ = GameParticipation.objects.get_or_create(
-                user=self.user,
-                session=session,
-                defaults={
+            created = GameParticipation.objects.upsert(session, self.user.id, number)
+            player_count = count_participant(session, self.user.id, number)
+            return {
+                'success': True,
+                'created': created,
+                'player_count': player_count,
+                'participation': {
+                    'user__username': self.user.username,
                     'selected_number': number,
-                    'is_winner': is_winner
-                }
-            )
-            participation.selected_number = number
-            participation.is_winner = is_winner
-            participation.save()
-
-            return {'success': True}
-        except GameParticipation.DoesNotExist:
-            return {'success': False, 'message': 'Not joined to session'}
+                    'is_winner': bool(session.winning_number and number == session.winning_number),
+                },
+            }
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @database_sync_to_async
+    def get_number_counts(self, session):
+        """How many players picked each number so far"""
+        live_counts = get_live_counts(session)
+        if live_counts is not None:
+            return live_counts[1]
+        number_counts = {number: 0 for number in range(1, 11)}
+        rows = session.participations.filter(
+            selected_number__isnull=False
+        ).values_list('selected_number').annotate(count=Count('id'))
+        for number, count in rows:
+            number_counts[number] = count
+        return number_counts
+
+    @database_sync_to_async
+    def get_session_snapshot(self, session):
+        """Full participation list of a session, only sent when a client asks for it"""
+        participations = list(session.participations.values('user__username', 'selected_number', 'is_winner'))
+        winners = [p['user__username'] for p in participations if p['is_winner']]
+        your_participation = next((p for p in participations if p['user__username'] == self.user.username), None)
+        return {
+            'session_id': session.session_id,
+            'winning_number': session.winning_number,
+            'participations': participations,
+            'winners': winners,
+            'your_participation': your_participation,
+        }
+
     async def handle_game_session_manager(self):
         result = await database_sync_to_async(game_session_manager)()
-        await self.send(text_data=json.dumps({'type': 'game_session_manager_result', 'result': self.serialize_session_manager_result(result)}))
+        await self.send_message({'type': 'game_session_manager_result', 'result': self.serialize_session_manager_result(result)})
 
     async def handle_end_session_and_create_new(self, session_id):
         result = await database_sync_to_async(end_session_and_create_new)(session_id)
-        await self.send(text_data=json.dumps({'type': 'end_session_and_create_new_result', 'result': result}))
+        await self.send_message({'type': 'end_session_and_create_new_result', 'result': result})
 
     async def handle_update_user_stats(self, session_id, winning_number):
         await database_sync_to_async(update_user_stats_for_session)(session_id, winning_number)
-        await self.send(text_data=json.dumps({'type': 'update_user_stats_result', 'success': True}))
+        await self.send_message({'type': 'update_user_stats_result', 'success': True})
 
     def serialize_session_manager_result(self, result):
         # Helper to serialize the session manager result for frontend
@@ -334,7 +372,7 @@ class GameConsumer(AsyncWebsocketConsumer):
             return None
         session = result.get('session')
         return {
-            'session_id': str(session.session_id) if session else None,
+            'session_id': session.session_id if session else None,
             'time_left': result.get('time_left'),
             'is_active': getattr(session, 'is_active', None) if session else None,
             'player_count': getattr(session, 'player_count', None) if session else None,
@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import threading
+from asgiref.sync import SyncToAsync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from redis.exceptions import RedisError
+from .utils import get_redis
+
+NUMBERS = range(1, 11)
+
+# Records that a user plays in a session and, if ARGV[2] is not 0, that they
+# picked that number. Moving a pick decrements the old number, so the per-number
+# counts always add up to the players who picked. Returns {joined, players}.
+RECORD_PARTICIPANT_SCRIPT = """
+local previous = redis.call('HGET', KEYS[1], ARGV[1])
+local joined = 0
+if not previous then
+    joined = 1
+    previous = '0'
+    redis.call('HSET', KEYS[1], ARGV[1], '0')
+    redis.call('INCR', KEYS[3])
+end
+if ARGV[2] ~= '0' and ARGV[2] ~= previous then
+    if previous ~= '0' then
+        redis.call('HINCRBY', KEYS[2], previous, -1)
+    end
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return {joined, tonumber(redis.call('GET', KEYS[3]))}
+"""
+
+_record_script = None
+
+
+def counter_keys(session_id):
+    """Keys of a session's user picks, per-number counts and player count"""
+    prefix = f'game:live:{session_id}'
+    return [f'{prefix}:choices', f'{prefix}:numbers', f'{prefix}:players']
+
+
+def histogram_lock_key(session_id):
+    return f'game:live:{session_id}:histogram'
+
+
+def joins_keys(session_id):
+    """Keys of a session's pending join notifications: recent usernames, join count and flush lock"""
+    prefix = f'game:live:{session_id}:joins'
+    return [f'{prefix}:usernames', f'{prefix}:count', f'{prefix}:lock']
+
+
+def record_participant(session, user_id, number=None):
+    """
+    Count the user as a player of `session` and, when given, their pick.
+    Returns `(joined, player_count)`, or None if Redis is unavailable.
+    """
+    global _record_script
+    try:
+        if _record_script is None:
+            _record_script = get_redis().register_script(RECORD_PARTICIPANT_SCRIPT)
+        joined, players = _record_script(
+            keys=counter_keys(session.pk),
+            args=[user_id, number or 0, settings.GAME_SESSION_DURATION * 3],
+        )
+        schedule_histogram(session)
+    except (RedisError, NotImplementedError):
+        return None
+    return bool(joined), players
+
+
+def get_live_counts(session):
+    """Return `(player_count, number_counts)` of `session`, or None if Redis is unavailable"""
+    _, numbers_key, players_key = counter_keys(session.pk)
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            pipe.get(players_key)
+            pipe.hgetall(numbers_key)
+            players, numbers = pipe.execute()
+    except (RedisError, NotImplementedError):
+        return None
+    number_counts = {number: 0 for number in NUMBERS}
+    for number, count in numbers.items():
+        number_counts[int(number)] = int(count)
+    return int(players or 0), number_counts
+
+
+def count_participant(session, user_id, number=None):
+    """Record the participant in the live counters and return the session's player count"""
+    recorded = record_participant(session, user_id, number)
+    return recorded[1] if recorded else session.participations.count()
+
+
+def live_player_count(session):
+    """Player count of `session`, live from Redis or from the database as a fallback"""
+    counts = get_live_counts(session)
+    if counts is None:
+        return session.participations.count()
+    return counts[0]
+
+
+def clear_live_counts(session):
+    """Drop the counters of a settled session; its player count now lives on the row"""
+    try:
+        get_redis().delete(*counter_keys(session.pk), histogram_lock_key(session.pk), *joins_keys(session.pk))
+    except (RedisError, NotImplementedError):
+        pass
+
+
+def schedule_histogram(session):
+    """Broadcast the selection histogram at most once per interval across all processes"""
+    _schedule_once(histogram_lock_key(session.pk), settings.SELECTION_HISTOGRAM_INTERVAL, histogram_event, session)
+
+
+def _schedule_once(lock_key, interval, build, session):
+    """
+    Broadcast the event returned by `build(session)` when `interval` ends,
+    unless another process already took this interval's lock; whatever was
+    recorded meanwhile is then covered by that single broadcast.
+    """
+    if not get_redis().set(lock_key, 1, nx=True, px=int(interval * 1000)):
+        return
+    # Under ASGI, send it from the server's event loop, which owns the channel layer.
+    # A fresh context keeps the flush from inheriting this sync call's executor.
+    loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    if loop is not None and loop.is_running():
+        loop.call_soon_threadsafe(
+            loop.call_later, interval, _flush_on_loop, build, session, context=contextvars.Context(),
+        )
+        return
+    timer = threading.Timer(interval, _flush, args=[build, session])
+    timer.daemon = True
+    timer.start()
+
+
+def _flush(build, session):
+    from .broadcast import broadcast
+
+    event = build(session)
+    if event:
+        broadcast(*event)
+
+
+def _flush_on_loop(build, session):
+    from .broadcast import room_broadcast
+
+    async def flush():
+        event = await database_sync_to_async(build)(session)
+        if event:
+            await room_broadcast(*event)
+
+    asyncio.ensure_future(flush())
+
+
+def histogram_event(session):
+    """The selection_histogram event of `session`, or None if there is nothing to show"""
+    counts = get_live_counts(session)
+    if counts is None or not counts[0]:
+        # Redis is down or the session was settled meanwhile
+        return None
+    player_count, number_counts = counts
+    return 'selection_histogram', {
+        'session_id': session.session_id,
+        'player_count': player_count,
+        'number_counts': number_counts,
+    }
+
+
+def announce_join(session, username):
+    """
+    Queue a player_joined notification. Joins within one flush window are
+    sent as a single broadcast with the latest player count and the most
+    recent usernames, so the fan-out grows with time rather than with joins.
+    """
+    from .broadcast import broadcast
+
+    usernames_key, count_key, lock_key = joins_keys(session.pk)
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            pipe.lpush(usernames_key, username)
+            pipe.ltrim(usernames_key, 0, settings.PLAYER_JOINED_MAX_USERNAMES - 1)
+            pipe.incr(count_key)
+            pipe.expire(usernames_key, settings.GAME_SESSION_DURATION * 3)
+            pipe.expire(count_key, settings.GAME_SESSION_DURATION * 3)
+            pipe.execute()
+        _schedule_once(lock_key, settings.PLAYER_JOINED_FLUSH_WINDOW, joins_event, session)
+    except (RedisError, NotImplementedError):
+        broadcast('player_joined', {
+            'username': username,
+            'usernames': [username],
+            'joined': 1,
+            'player_count': live_player_count(session),
+        })
+
+
+def joins_event(session):
+    """The player_joined event for the joins queued during the last window, if any"""
+    usernames_key, count_key, _ = joins_keys(session.pk)
+    try:
+        with get_redis().pipeline() as pipe:
+            pipe.lrange(usernames_key, 0, -1)
+            pipe.get(count_key)
+            pipe.delete(usernames_key, count_key)
+            usernames, joined, _ = pipe.execute()
+    except (RedisError, NotImplementedError):
+        return None
+    if not usernames:
+        return None
+    usernames = [username.decode() for username in usernames]
+    return 'player_joined', {
+        'username': usernames[0],
+        'usernames': usernames,
+        'joined': int(joined or len(usernames)),
+        'player_count': live_player_count(session),
+    }
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import uuid
+from datetime import timedelta
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+from .leaderboard import ensure_leaderboard
+from .models import GameSession
+from .utils import create_new_session, get_redis, settle_and_rotate
+
+logger = logging.getLogger(__name__)
+
+# Takes the engine lease, or extends it if ARGV[1] already holds it; returns 1 on success
+HOLD_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+LEASE_KEY = 'game:engine:leader'
+
+
+class SessionEngine:
+    """
+    Event-driven game session lifecycle.
+
+    Instead of polling the database, the engine sleeps until the active
+    session's deadline, then settles it and starts the next one at that moment.
+    Several engines may run side by side for availability, but only the one
+    holding the lease in Redis drives sessions; the others wait to take over.
+    """
+
+    retry_delay = 1
+
+    def __init__(self):
+        self._stopped = None
+        self.token = uuid.uuid4().hex
+        self.leader = False
+
+    async def run(self):
+        self._stopped = asyncio.Event()
+        self.leader = await database_sync_to_async(self.hold_lease)()
+        keeper = asyncio.ensure_future(self.keep_lease())
+        rebuilder = asyncio.ensure_future(self.keep_leaderboard())
+        try:
+            await self.drive()
+        finally:
+            keeper.cancel()
+            rebuilder.cancel()
+            await database_sync_to_async(self.release_lease)()
+
+    async def drive(self):
+        session = None
+        while not self._stopped.is_set():
+            try:
+                if not self.leader:
+                    session = None
+                    if await self.sleep(self.retry_delay):
+                        break
+                    continue
+                if session is None:
+                    session = await database_sync_to_async(self.current_session)()
+                    if session is None:
+                        if await self.sleep(self.retry_delay):
+                            break
+                        continue
+                if await self.sleep_until(session.deadline):
+                    break
+                if not self.leader:
+                    continue
+                result = await database_sync_to_async(settle_and_rotate)(session)
+                session = result['session'] if result else None
+            except Exception:
+                logger.exception('Game session engine failed to rotate session')
+                session = None
+                if await self.sleep(self.retry_delay):
+                    break
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def current_session(self):
+        """
+        The active session, or a new one if none is active. While a session
+        that ended moments ago is being settled, whoever claimed its end is
+        about to publish the next one, so nothing is created until that window
+        has passed without it.
+        """
+        session = GameSession.objects.get_current_active_session()
+        if session is not None:
+            return session
+        recently = timezone.now() - timedelta(seconds=settings.GAME_ENGINE_LEASE)
+        if GameSession.objects.filter(end_time__gte=recently).exists():
+            return None
+        return create_new_session()
+
+    async def keep_lease(self):
+        """Renew the lease in the background, so a long settlement cannot let it lapse"""
+        while True:
+            await asyncio.sleep(settings.GAME_ENGINE_LEASE / 3)
+            self.leader = await database_sync_to_async(self.hold_lease)()
+
+    async def keep_leaderboard(self):
+        """
+        Rebuild the leaderboard sorted set whenever Redis has lost it, off the
+        thread that settles sessions. Requests read the database meanwhile.
+        """
+        while True:
+            if self.leader:
+                await database_sync_to_async(self.rebuild_leaderboard, thread_sensitive=False)()
+            await asyncio.sleep(settings.GAME_ENGINE_LEASE)
+
+    def rebuild_leaderboard(self):
+        try:
+            ensure_leaderboard()
+        except (RedisError, NotImplementedError):
+            pass
+        except Exception:
+            logger.exception('Game session engine failed to rebuild the leaderboard')
+
+    def hold_lease(self):
+        """
+        Take or extend the lease that makes this engine the one driving sessions.
+        Without Redis there is no lease to share, so the engine keeps running;
+        the claim on each session end still keeps settlement single.
+        """
+        try:
+            return bool(get_redis().eval(
+                HOLD_LEASE_SCRIPT, 1, LEASE_KEY, self.token, int(settings.GAME_ENGINE_LEASE * 1000),
+            ))
+        except (RedisError, NotImplementedError):
+            logger.warning('Redis unavailable, game session engine running without a lease')
+            return True
+
+    def release_lease(self):
+        try:
+            get_redis().eval(RELEASE_LEASE_SCRIPT, 1, LEASE_KEY, self.token)
+        except (RedisError, NotImplementedError):
+            pass
+
+    async def sleep_until(self, moment):
+        return await self.sleep((moment - timezone.now()).total_seconds())
+
+    async def sleep(self, delay):
+        """Wait for `delay` seconds; returns True if the engine was stopped meanwhile"""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=max(delay, 0))
+        except asyncio.TimeoutError:
+            return False
+        return True
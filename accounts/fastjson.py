@@ -0,0 +1,35 @@
+import decimal
+import orjson
+from django.utils.functional import Promise
+
+# Integer-keyed maps such as number_counts are valid payloads
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+JSONDecodeError = orjson.JSONDecodeError
+
+
+def default(obj):
+    """Encode the types orjson does not handle natively (UUID and datetime are native)"""
+    if isinstance(obj, (Promise, decimal.Decimal)):
+        return str(obj)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj, indent=False):
+    """Encode `obj` to JSON bytes"""
+    option = DUMPS_OPTIONS | orjson.OPT_INDENT_2 if indent else DUMPS_OPTIONS
+    return orjson.dumps(obj, default=default, option=option)
+
+
+def dumps_text(obj):
+    """Encode `obj` to a JSON string, e.g. for a WebSocket text frame"""
+    return dumps(obj).decode('utf-8')
+
+
+def loads(data):
+    """Decode JSON from bytes or str"""
+    return orjson.loads(data)
@@ -3,6 +3,7 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import HTTP_HEADER_ENCODING, authentication
 from .exceptions import AuthenticationFailed, InvalidToken, TokenError
 from .jwtsetting import api_settings
+from .user_cache import get_cached_user
 
 AUTH_HEADER_TYPES = api_settings.AUTH_HEADER_TYPES
 
@@ -115,7 +116,7 @@ class JWTAuthentication(authentication.BaseAuthentication):
             raise InvalidToken(_("Token contained no recognizable user identification"))
 
         try:
-            user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            user = get_cached_user(user_id)
         except self.user_model.DoesNotExist:
             raise AuthenticationFailed(_("User not found"), code="user_not_found")
 
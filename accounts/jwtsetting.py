@@ -21,6 +21,8 @@ DEFAULTS = {
     "ISSUER": None,
     "JWK_URL": None,
     "LEEWAY": 0,
+    "VERIFIED_TOKEN_CACHE_SIZE": 10000,
+    "VERIFIED_TOKEN_CACHE_TTL": timedelta(minutes=5),
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
     "USER_ID_FIELD": "id",
@@ -0,0 +1,152 @@
+from django.db.models import Q
+from redis.exceptions import RedisError
+from .models import LEADERBOARD_ORDERING, UserGameStats
+from .utils import get_redis
+
+# Members are zero-padded user ids, so ZREVRANGE orders equal scores by
+# descending user id like the database queries do. Sets of unpadded members
+# were kept under other keys and are never read.
+LEADERBOARD_KEY = 'game:leaderboard:ranked'
+LEADERBOARD_READY_KEY = 'game:leaderboard:ranked:ready'
+LEADERBOARD_REBUILD_LOCK = 'game:leaderboard:ranked:rebuild'
+REBUILD_BATCH_SIZE = 5000
+MEMBER_DIGITS = 12
+
+# The composite score packs (wins, games_played, best_streak) into the 53 bits a
+# Redis score can hold exactly, so one ZREVRANGE orders by all three columns.
+WINS_BITS = 22
+GAMES_PLAYED_BITS = 22
+BEST_STREAK_BITS = 9
+
+
+def leaderboard_score(wins, games_played, best_streak):
+    """Composite sorted-set score, ordered like wins, games_played, best_streak descending"""
+    wins = min(wins, (1 << WINS_BITS) - 1)
+    games_played = min(games_played, (1 << GAMES_PLAYED_BITS) - 1)
+    best_streak = min(best_streak, (1 << BEST_STREAK_BITS) - 1)
+    return (wins << (GAMES_PLAYED_BITS + BEST_STREAK_BITS)) | (games_played << BEST_STREAK_BITS) | best_streak
+
+
+class LeaderboardNotReady(Exception):
+    """The sorted set is missing or still being rebuilt; read the database instead"""
+
+
+def leaderboard_member(user_id):
+    return f'{user_id:0{MEMBER_DIGITS}d}'
+
+
+def update_leaderboard(stats_rows):
+    """Write `(user_id, wins, games_played, best_streak)` rows into the sorted set"""
+    redis = get_redis()
+    with redis.pipeline(transaction=False) as pipe:
+        batch = {}
+        for user_id, wins, games_played, best_streak in stats_rows:
+            batch[leaderboard_member(user_id)] = leaderboard_score(wins, games_played, best_streak)
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                pipe.zadd(LEADERBOARD_KEY, batch)
+                batch = {}
+        if batch:
+            pipe.zadd(LEADERBOARD_KEY, batch)
+        pipe.execute()
+
+
+def update_leaderboard_for_session(session_id):
+    """Refresh the scores of everyone who played in the given session"""
+    rows = UserGameStats.objects.filter(
+        user__game_participations__session_id=session_id
+    ).values_list('user_id', 'wins', 'games_played', 'best_streak')
+    try:
+        update_leaderboard(rows.iterator())
+    except (RedisError, NotImplementedError):
+        pass
+
+
+def ensure_leaderboard():
+    """
+    Populate the sorted set from the database unless it has been fully built
+    already. This scans the whole stats table, so it runs in the session engine
+    rather than in requests.
+    """
+    redis = get_redis()
+    if redis.exists(LEADERBOARD_READY_KEY):
+        return
+    if not redis.set(LEADERBOARD_REBUILD_LOCK, 1, nx=True, ex=60):
+        return
+    try:
+        rows = UserGameStats.objects.values_list('user_id', 'wins', 'games_played', 'best_streak')
+        update_leaderboard(rows.iterator(chunk_size=REBUILD_BATCH_SIZE))
+        redis.set(LEADERBOARD_READY_KEY, 1)
+    finally:
+        redis.delete(LEADERBOARD_REBUILD_LOCK)
+
+
+def get_top(limit=10):
+    """
+    Return `(user_id, rank)` pairs for the top `limit` players. Raises
+    `LeaderboardNotReady` while the sorted set is incomplete.
+    """
+    redis = get_redis()
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.exists(LEADERBOARD_READY_KEY)
+        pipe.zrevrange(LEADERBOARD_KEY, 0, limit - 1)
+        ready, user_ids = pipe.execute()
+    if not ready:
+        raise LeaderboardNotReady
+    return [(int(user_id), rank) for rank, user_id in enumerate(user_ids, 1)]
+
+
+def get_around(user_id, radius=5):
+    """
+    Return the user's rank and `(user_id, rank)` pairs for the `radius` players
+    above and below them, or `(None, [])` if the user has no ranking yet.
+    Raises `LeaderboardNotReady` while the sorted set is incomplete.
+    """
+    redis = get_redis()
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.exists(LEADERBOARD_READY_KEY)
+        pipe.zrevrank(LEADERBOARD_KEY, leaderboard_member(user_id))
+        ready, position = pipe.execute()
+    if not ready:
+        raise LeaderboardNotReady
+    if position is None:
+        return None, []
+    start = max(position - radius, 0)
+    user_ids = redis.zrevrange(LEADERBOARD_KEY, start, position + radius)
+    return position + 1, [(int(member), rank) for rank, member in enumerate(user_ids, start + 1)]
+
+
+def get_around_from_db(user_id, radius=5):
+    """
+    Database fallback of `get_around` for when the sorted set cannot be used. The rank
+    is one COUNT of the players ahead; equal scores are ordered by user id.
+    """
+    stats = UserGameStats.objects.filter(user_id=user_id).values('wins', 'games_played', 'best_streak').first()
+    if stats is None:
+        return None, []
+    wins, games_played, best_streak = stats['wins'], stats['games_played'], stats['best_streak']
+    ahead = (
+        Q(wins__gt=wins)
+        | Q(wins=wins, games_played__gt=games_played)
+        | Q(wins=wins, games_played=games_played, best_streak__gt=best_streak)
+        | Q(wins=wins, games_played=games_played, best_streak=best_streak, user_id__gt=user_id)
+    )
+    position = UserGameStats.objects.filter(ahead).count()
+    start = max(position - radius, 0)
+    user_ids = UserGameStats.objects.order_by(
+        *LEADERBOARD_ORDERING
+    ).values_list('user_id', flat=True)[start:position + radius + 1]
+    return position + 1, [(member, rank) for rank, member in enumerate(user_ids, start + 1)]
+
+
+def ranked_stats(entries):
+    """Load the stats rows for `(user_id, rank)` pairs in one query, keeping the ranking order"""
+    stats_by_user = UserGameStats.objects.select_related('user').in_bulk(
+        [user_id for user_id, _ in entries], field_name='user_id'
+    )
+    ranked = []
+    for user_id, rank in entries:
+        stats = stats_by_user.get(user_id)
+        if stats is not None:
+            stats.rank = rank
+            ranked.append(stats)
+    return ranked
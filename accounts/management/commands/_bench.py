@@ -0,0 +1,98 @@
+"""Helpers shared by the benchmark management commands"""
+import json
+import os
+from contextlib import contextmanager
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from redis.exceptions import RedisError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """
+    Run the benchmark against a throwaway test database, never the one the
+    settings point at. Redis and the channel layer are still the configured
+    ones, so benchmarks are meant to run against a local Redis.
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def create_bench_users(count, prefix='bench', password=None):
+    """Create `count` users sharing one password hash in batched inserts and return them"""
+    User = get_user_model()
+    password = make_password(password)
+    User.objects.bulk_create(
+        (User(username=f'{prefix}_{i}', password=password) for i in range(count)),
+        batch_size=5000,
+    )
+    return list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id'))
+
+
+def reset_game_state():
+    """Forget the cached current session and leaderboard, which belong to another database"""
+    from accounts.leaderboard import LEADERBOARD_KEY, LEADERBOARD_READY_KEY
+    from accounts.session_cache import invalidate_current_session
+    from accounts.utils import get_redis
+    invalidate_current_session()
+    try:
+        get_redis().delete(LEADERBOARD_KEY, LEADERBOARD_READY_KEY)
+    except (RedisError, NotImplementedError):
+        pass
+
+
+def build_leaderboard():
+    """Build the leaderboard sorted set from the seeded stats, as the session engine does"""
+    from accounts.leaderboard import ensure_leaderboard
+    try:
+        ensure_leaderboard()
+    except (RedisError, NotImplementedError):
+        pass
+
+
+def percentiles(values):
+    """Summary of a list of durations in seconds, reported in milliseconds"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p95': rank(95),
+        'p99': rank(99),
+        'max': round(ordered[-1] * 1000, 2),
+    }
+
+
+def resident_memory():
+    """Resident set size of this process in bytes (Linux only, None elsewhere)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def check_budgets(results, budgets):
+    """Raise CommandError listing every `(label, value, limit)` that is over its limit"""
+    failures = [f'{label}: {value} > {limit}' for label, value, limit in budgets
+                if limit is not None and value is not None and value > limit]
+    if failures:
+        raise CommandError('Benchmark budget exceeded:\n  ' + '\n  '.join(failures))
+
+
+def write_report(path, results):
+    with open(path, 'w') as report:
+        json.dump(results, report, indent=2, default=str)
@@ -0,0 +1,206 @@
+import random
+import time
+from collections import namedtuple
+from itertools import islice
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.models import GameParticipation, GameSession, UserGameStats
+from accounts.serializers import default_password
+from accounts.token import AccessToken
+from ._bench import (
+    build_leaderboard, check_budgets, create_bench_users, percentiles, reset_game_state, test_database,
+    write_report,
+)
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+RATE_LIMIT_MIDDLEWARE = 'accounts.middleware.RateLimitMiddleware'
+SEED_BATCH_SIZE = 10000
+
+# `actor` is who sends the request: the seeded player with a long history, or a
+# fresh user per iteration for endpoints that can only succeed once per user.
+Case = namedtuple('Case', 'name method url payload actor status')
+
+# Most SQL queries a single request of each case may issue, for the default
+# seed shape (sessions of 100 players, a player history of 100 sessions)
+QUERY_BUDGETS = {
+    'login_token': 1,
+    'current_session': 1,
+    'join_session': 3,
+    'select_number': 1,
+    'session_status': 2,
+    'session_history': 2,
+    'game_history': 1,
+    'leaderboard': 1,
+    'leaderboard_around_me': 1,
+    'user_stats': 3,
+}
+
+
+class QueryCounter:
+    """Execute wrapper counting every SQL statement, without the query log's size limit"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database at production-like sizes and benchmark every REST endpoint, '
+        'reporting latency percentiles and the number of SQL queries per request. Fails when an '
+        'endpoint goes over its query budget.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Number of seeded users')
+        parser.add_argument('--participations', type=int, default=1000000, help='Number of seeded participations')
+        parser.add_argument('--session-size', type=int, default=100, help='Players per seeded session')
+        parser.add_argument('--history', type=int, default=100, help='Past sessions played by the benchmark user')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint')
+        parser.add_argument('--in-memory', action='store_true', help='Use the in-memory channel layer instead of Redis')
+        parser.add_argument('--report', help='Write the results as JSON to this path')
+        parser.add_argument('--max-p95', type=float, help='Fail if any endpoint p95 (ms) is above this')
+
+    def handle(self, *args, **options):
+        # Every request comes from one address, so the rate limiter would answer most of them with 429
+        overrides = {'MIDDLEWARE': [name for name in settings.MIDDLEWARE if name != RATE_LIMIT_MIDDLEWARE]}
+        if options['in_memory']:
+            overrides['CHANNEL_LAYERS'] = IN_MEMORY_CHANNEL_LAYERS
+        with override_settings(**overrides), test_database():
+            reset_game_state()
+            started = time.perf_counter()
+            player, joiners, session = self.seed(options)
+            self.stdout.write(f'Seeded in {time.perf_counter() - started:.1f}s')
+            results = {case.name: self.run_case(case, player, joiners, options) for case in self.cases(player, session)}
+            reset_game_state()
+
+        self.report(results)
+        if options['report']:
+            write_report(options['report'], results)
+        budgets = []
+        for name, result in results.items():
+            budgets.append((f'{name} failed requests', result['failures'], 0))
+            budgets.append((f'{name} queries', result['queries']['max'], QUERY_BUDGETS.get(name)))
+            budgets.append((f'{name} p95 (ms)', result['latency'].get('p95'), options['max_p95']))
+        check_budgets(results, budgets)
+
+    def cases(self, player, session):
+        return [
+            Case('login_token', 'post', reverse('login-token'), {'username': player.username}, None, 200),
+            Case('current_session', 'get', reverse('current_session'), None, 'player', 200),
+            Case('join_session', 'post', reverse('join_session'), None, 'joiner', 200),
+            Case('select_number', 'post', reverse('select_number'), {'selected_number': 7}, 'joiner', 200),
+            Case('session_status', 'get', reverse('session_status', args=[session.session_id]), None, 'player', 200),
+            Case('session_history', 'get', reverse('session_history'), None, 'player', 200),
+            Case('game_history', 'get', reverse('game_history'), None, 'player', 200),
+            Case('leaderboard', 'get', reverse('leaderboard'), None, 'player', 200),
+            Case('leaderboard_around_me', 'get', reverse('leaderboard_around_me'), None, 'player', 200),
+            Case('user_stats', 'get', reverse('user_stats', args=[player.id]), None, 'player', 200),
+        ]
+
+    def seed(self, options):
+        """
+        Seed ended sessions of `session_size` players each, plus one active
+        session, and return the benchmark player, the users that join during
+        the run and the active session.
+        """
+        session_size = options['session_size']
+        requests_per_case = options['warmup'] + options['iterations']
+        users = create_bench_users(options['users'] + 1, password=default_password)
+        player, pool = users[0], users[1:]
+        if len(pool) < session_size * 2 + requests_per_case:
+            raise ValueError('Not enough users for the session size and iterations')
+        joiners, active_players = pool[:requests_per_case], pool[-session_size:]
+
+        UserGameStats.objects.bulk_create(
+            (UserGameStats(
+                user_id=user.id,
+                games_played=random.randint(0, 500),
+                wins=random.randint(0, 50),
+                best_streak=random.randint(0, 5),
+                last_played=timezone.now(),
+            ) for user in users),
+            batch_size=SEED_BATCH_SIZE,
+        )
+
+        now = timezone.now()
+        GameSession.objects.bulk_create(
+            (GameSession(
+                is_active=False, end_time=now, winning_number=random.randint(1, 10), player_count=session_size,
+            ) for _ in range(max(options['participations'] // session_size, options['history']))),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        session_ids = list(GameSession.objects.order_by('id').values_list('id', flat=True))
+        player_sessions = set(session_ids[-options['history']:])
+
+        def participations():
+            for index, session_id in enumerate(session_ids):
+                for offset in range(session_size):
+                    user = pool[(index * session_size + offset) % len(pool)]
+                    number = random.randint(1, 10)
+                    yield GameParticipation(user_id=user.id, session_id=session_id, selected_number=number)
+                if session_id in player_sessions:
+                    yield GameParticipation(user_id=player.id, session_id=session_id, selected_number=1)
+
+        rows = participations()
+        while True:
+            batch = list(islice(rows, SEED_BATCH_SIZE))
+            if not batch:
+                break
+            GameParticipation.objects.bulk_create(batch, ignore_conflicts=True)
+
+        session = GameSession.objects.create(player_count=session_size)
+        GameParticipation.objects.bulk_create(
+            GameParticipation(user_id=user.id, session=session, selected_number=random.randint(1, 10))
+            for user in active_players
+        )
+        build_leaderboard()
+        return player, joiners, session
+
+    def run_case(self, case, player, joiners, options):
+        client = APIClient()
+        tokens = {}
+        latencies, query_counts, sizes, failures = [], [], [], 0
+        for iteration in range(options['warmup'] + options['iterations']):
+            user = joiners[iteration] if case.actor == 'joiner' else player
+            headers = {}
+            if case.actor is not None:
+                if user.id not in tokens:
+                    tokens[user.id] = f'Bearer {AccessToken.for_user(user)}'
+                headers['HTTP_AUTHORIZATION'] = tokens[user.id]
+
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                response = getattr(client, case.method)(case.url, case.payload, format='json', **headers)
+                elapsed = time.perf_counter() - started
+            if response.status_code != case.status:
+                failures += 1
+            if iteration >= options['warmup']:
+                latencies.append(elapsed)
+                query_counts.append(queries.count)
+                sizes.append(len(response.content))
+        return {
+            'latency': percentiles(latencies),
+            'queries': {'min': min(query_counts), 'max': max(query_counts)},
+            'response_bytes': max(sizes),
+            'failures': failures,
+        }
+
+    def report(self, results):
+        for name, result in results.items():
+            latency = '  '.join(f'{key}={value}' for key, value in result['latency'].items() if key != 'count')
+            queries = result['queries']
+            self.stdout.write(
+                f"{name:>22}: {latency}  queries={queries['min']}..{queries['max']}"
+                f"  budget={QUERY_BUDGETS.get(name)}  bytes={result['response_bytes']}  failures={result['failures']}"
+            )
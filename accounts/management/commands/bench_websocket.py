@@ -0,0 +1,259 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from accounts import fastjson
+from accounts.models import GameSession
+from accounts.protocol import MESSAGE_NAMES, MSGPACK_SUBPROTOCOL, decode_binary, encode_binary
+from accounts.token import AccessToken
+from ._bench import check_budgets, create_bench_users, percentiles, resident_memory, test_database, write_report
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class Recorder:
+    """Measurements collected by every client of a run"""
+
+    def __init__(self):
+        self.connect = []
+        self.join_rtt = []
+        self.select_rtt = []
+        self.session_ended = defaultdict(list)
+        self.frames = 0
+        self.connect_failures = 0
+        self.timeouts = 0
+        self.errors = 0
+
+
+class BenchClient:
+    """One authenticated socket driven through the ASGI application in-process"""
+
+    def __init__(self, application, user, recorder, binary=False):
+        self.user = user
+        self.recorder = recorder
+        self.binary = binary
+        self.communicator = WebsocketCommunicator(
+            application, 'ws/game/',
+            headers=[(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())],
+            subprotocols=[MSGPACK_SUBPROTOCOL] if binary else None,
+        )
+        self.waiters = []
+        self.reader = None
+
+    async def connect(self, timeout):
+        started = time.perf_counter()
+        try:
+            connected, _ = await self.communicator.connect(timeout)
+        except asyncio.TimeoutError:
+            connected = False
+        if not connected:
+            self.recorder.connect_failures += 1
+            return False
+        self.recorder.connect.append(time.perf_counter() - started)
+        self.reader = asyncio.ensure_future(self.read())
+        return True
+
+    async def read(self):
+        # Read the output queue directly: receive_output() cancels the application on a timeout
+        while True:
+            frame = await self.communicator.output_queue.get()
+            if frame['type'] == 'websocket.close':
+                for _, _, future in self.waiters:
+                    future.cancel()
+                return
+            self.recorder.frames += 1
+            message = self.decode(frame)
+            message_type = message.get('type')
+            if message_type == 'session_ended':
+                self.recorder.session_ended[str(message['session_id'])].append(time.time())
+            elif message_type == 'error':
+                self.recorder.errors += 1
+            for waiter in list(self.waiters):
+                expected, match, future = waiter
+                if expected == message_type and (match is None or match(message)):
+                    self.waiters.remove(waiter)
+                    if not future.done():
+                        future.set_result(time.perf_counter())
+
+    def decode(self, frame):
+        if frame.get('bytes') is not None:
+            message = decode_binary(frame['bytes'])
+            message['type'] = MESSAGE_NAMES.get(message.get('type'), message.get('type'))
+            return message
+        return fastjson.loads(frame['text'])
+
+    def expect(self, message_type, match=None):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((message_type, match, future))
+        return future
+
+    async def send(self, message):
+        if self.binary:
+            await self.communicator.send_to(bytes_data=encode_binary(message))
+        else:
+            await self.communicator.send_to(text_data=fastjson.dumps_text(message))
+
+    async def wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.recorder.timeouts += 1
+            return None
+
+    async def request(self, message, reply_type, match, samples, timeout):
+        """Send a message and record the time until its reply arrives"""
+        reply = self.expect(reply_type, match)
+        started = time.perf_counter()
+        await self.send(message)
+        received = await self.wait(reply, timeout)
+        if received is not None:
+            samples.append(received - started)
+
+    async def play(self, sessions, duration):
+        """Join and pick a number in each of `sessions` consecutive sessions"""
+        username = self.user.username
+        for _ in range(sessions):
+            started = self.expect('session_started')
+            if await self.wait(started, duration * 2 + 5) is None:
+                return
+            # Spread the traffic over the first half of the session, like real players
+            await asyncio.sleep(random.uniform(0, duration / 2))
+            await self.request(
+                {'type': 'join_session'}, 'player_joined',
+                # A batch over the username cap may have left this user out of the list
+                lambda message: username in message['usernames'] or message['joined'] > len(message['usernames']),
+                self.recorder.join_rtt, duration,
+            )
+            await self.request(
+                {'type': 'select_number', 'number': random.randint(1, 10)}, 'number_selected', None,
+                self.recorder.select_rtt, duration,
+            )
+
+    async def close(self):
+        try:
+            await self.communicator.disconnect(timeout=5)
+        except asyncio.TimeoutError:
+            pass
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many authenticated game sockets in-process and drive join/select traffic across '
+        'several sessions, reporting connect latency, round trips, session_ended fan-out delay '
+        'and memory per connection. Uses a throwaway test database and the configured Redis.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500, help='Number of sockets to open')
+        parser.add_argument('--sessions', type=int, default=2, help='Number of sessions every client plays')
+        parser.add_argument('--session-duration', type=int, help='Session length in seconds (default: GAME_SESSION_DURATION)')
+        parser.add_argument('--connect-concurrency', type=int, default=100, help='Sockets connecting at the same time')
+        parser.add_argument('--connect-timeout', type=float, default=10)
+        parser.add_argument('--binary', action='store_true', help='Use the MessagePack subprotocol')
+        parser.add_argument('--in-memory', action='store_true', help='Use the in-memory channel layer instead of Redis')
+        parser.add_argument('--write-behind', action='store_true', help='Buffer selections in Redis until settlement')
+        parser.add_argument('--report', help='Write the results as JSON to this path')
+        parser.add_argument('--max-connect-p95', type=float, help='Fail if the connect p95 (ms) is above this')
+        parser.add_argument('--max-rtt-p95', type=float, help='Fail if the select_number round trip p95 (ms) is above this')
+        parser.add_argument('--max-fanout-p95', type=float, help='Fail if the session_ended delay p95 (ms) is above this')
+        parser.add_argument('--max-memory-per-connection', type=int, help='Fail if memory per connection (bytes) is above this')
+
+    def handle(self, *args, **options):
+        options['session_duration'] = options['session_duration'] or settings.GAME_SESSION_DURATION
+        overrides = {
+            'GAME_SESSION_DURATION': options['session_duration'],
+            'GAME_SELECTION_WRITE_BEHIND': options['write_behind'],
+        }
+        if options['in_memory']:
+            overrides['CHANNEL_LAYERS'] = IN_MEMORY_CHANNEL_LAYERS
+
+        with override_settings(**overrides), test_database():
+            users = create_bench_users(options['connections'])
+            results = asyncio.run(self.run(users, options))
+            results['session_ended'] = self.fanout(results.pop('receipts'), options['connections'])
+
+        self.report(results)
+        if options['report']:
+            write_report(options['report'], results)
+        check_budgets(results, [
+            ('connect p95 (ms)', results['connect'].get('p95'), options['max_connect_p95']),
+            ('select_number p95 (ms)', results['select_number_rtt'].get('p95'), options['max_rtt_p95']),
+            ('session_ended p95 (ms)', results['session_ended'].get('p95'), options['max_fanout_p95']),
+            ('memory per connection (bytes)', results['memory_per_connection'], options['max_memory_per_connection']),
+        ])
+
+    async def run(self, users, options):
+        from igame.asgi import application
+        from accounts.engine import SessionEngine
+        from accounts.session_cache import invalidate_current_session
+
+        invalidate_current_session()
+        engine = SessionEngine()
+        engine_task = asyncio.ensure_future(engine.run())
+        recorder = Recorder()
+        clients = [BenchClient(application, user, recorder, options['binary']) for user in users]
+
+        memory_before = resident_memory()
+        semaphore = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def connect(client):
+            async with semaphore:
+                return await client.connect(options['connect_timeout'])
+
+        started = time.perf_counter()
+        connected = [client for client, ok in zip(clients, await asyncio.gather(*map(connect, clients))) if ok]
+        connect_wall = time.perf_counter() - started
+        memory_after = resident_memory()
+        self.stdout.write(f'{len(connected)}/{len(clients)} sockets connected in {connect_wall:.1f}s')
+
+        await asyncio.gather(*(client.play(options['sessions'], options['session_duration']) for client in connected))
+        # Let the last session end so its fan-out is measured as well
+        await asyncio.sleep(options['session_duration'] + 1)
+
+        engine.stop()
+        await engine_task
+        await asyncio.gather(*(client.close() for client in connected))
+        invalidate_current_session()
+
+        memory_per_connection = None
+        if connected and memory_before is not None and memory_after is not None:
+            memory_per_connection = (memory_after - memory_before) // len(connected)
+        return {
+            'connections': len(connected),
+            'connect_failures': recorder.connect_failures,
+            'connect_seconds': round(connect_wall, 2),
+            'connect': percentiles(recorder.connect),
+            'join_session_rtt': percentiles(recorder.join_rtt),
+            'select_number_rtt': percentiles(recorder.select_rtt),
+            'memory_per_connection': memory_per_connection,
+            'frames_received': recorder.frames,
+            'timeouts': recorder.timeouts,
+            'errors': recorder.errors,
+            'receipts': dict(recorder.session_ended),
+        }
+
+    def fanout(self, receipts, connections):
+        """Delay between a session being ended and each socket receiving session_ended"""
+        end_times = dict(GameSession.objects.filter(
+            session_id__in=list(receipts), end_time__isnull=False,
+        ).values_list('session_id', 'end_time'))
+        delays = []
+        for session_id, end_time in end_times.items():
+            ended_at = end_time.timestamp()
+            delays.extend(received - ended_at for received in receipts[str(session_id)])
+        summary = percentiles(delays)
+        summary['sessions'] = len(end_times)
+        summary['expected'] = len(end_times) * connections
+        return summary
+
+    def report(self, results):
+        for name, value in results.items():
+            if isinstance(value, dict):
+                value = '  '.join(f'{key}={item}' for key, item in value.items())
+            self.stdout.write(f'{name:>24}: {value}')
@@ -0,0 +1,32 @@
+import asyncio
+import signal
+from django.core.management.base import BaseCommand
+from accounts.engine import SessionEngine
+from accounts.metrics import start_http_server
+
+
+class Command(BaseCommand):
+    help = 'Start the game session manager'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metrics-port', type=int, default=0,
+            help='Serve /metrics on this port, since settlement is measured in this process (0 disables)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Starting game session manager'))
+        if options['metrics_port']:
+            start_http_server(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        engine = SessionEngine()
+
+        async def run_engine():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, engine.stop)
+            await engine.run()
+
+        asyncio.run(run_engine())
+        self.stdout.write(self.style.SUCCESS('Game manager stopped'))
@@ -1,14 +1,76 @@
 from django.http import JsonResponse
-from django.core.cache import cache
 from django.conf import settings
+from redis.exceptions import RedisError
+from .metrics import HTTP_REQUEST_DURATION
+from .profiling import profile_queries
+from .utils import get_redis
+import threading
 import time
 
+# Token bucket holding `capacity` tokens that refill evenly over `window_ms`.
+# Runs atomically in Redis so concurrent requests cannot lose updates.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * capacity / window_ms)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window_ms)
+return allowed
+"""
+
+
+class LocalTokenBuckets:
+    """In-process token buckets used to reject floods before contacting Redis"""
+
+    max_keys = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def take(self, key, capacity, window):
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * capacity / window)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if key not in self.buckets and len(self.buckets) >= self.max_keys:
+                self.prune(now, window)
+            self.buckets[key] = (tokens, now)
+        return allowed
+
+    def prune(self, now, window):
+        """Forget buckets idle for a whole window, they would be full again anyway"""
+        self.buckets = {
+            key: (tokens, last) for key, (tokens, last) in self.buckets.items()
+            if now - last < window
+        }
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.clear()
+
 
 class RateLimitMiddleware:
     """Rate limiting middleware"""
     
     def __init__(self, get_response):
         self.get_response = get_response
+        self.local_buckets = LocalTokenBuckets()
+        self.bucket_script = None
 
     def __call__(self, request):
         # Check rate limit for specific endpoints
@@ -49,24 +111,26 @@ class RateLimitMiddleware:
         )
 
         cache_key = f"rate_limit:{client_ip}:{settings_key}"
-        current_time = int(time.time())
-        window_start = current_time - rate_settings['window']
+        capacity = rate_settings['max_requests']
+        window = rate_settings['window']
 
-        # Get current requests in window
-        requests = cache.get(cache_key, [])
-        
-        # Filter requests within current window
-        requests = [req_time for req_time in requests if req_time > window_start]
-        
-        # Check if limit exceeded
-        if len(requests) >= rate_settings['max_requests']:
+        # A single process seeing more than the global limit is a flood, no need to ask Redis
+        if not self.local_buckets.take(cache_key, capacity, window):
             return False
 
-        # Add current request
-        requests.append(current_time)
-        cache.set(cache_key, requests, rate_settings['window'])
-        
-        return True
+        try:
+            return bool(self.get_bucket_script()(
+                keys=[cache_key],
+                args=[capacity, window * 1000, int(time.time() * 1000)],
+            ))
+        except (RedisError, NotImplementedError):
+            # Fail open on the shared limiter; the local bucket still applies
+            return True
+
+    def get_bucket_script(self):
+        if self.bucket_script is None:
+            self.bucket_script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        return self.bucket_script
 
     def get_client_ip(self, request):
         """Get client IP address"""
@@ -76,3 +140,39 @@ class RateLimitMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
+
+
+class MetricsMiddleware:
+    """Record request latency per route pattern, so paths with ids share one series"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=match.route if match else 'unmatched',
+            status=response.status_code,
+        )
+        return response
+
+
+class QueryProfilerMiddleware:
+    """Report the SQL work of each request in response headers when the query profiler is enabled"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_PROFILER_ENABLED:
+            return self.get_response(request)
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        response['X-DB-Query-Count'] = profile.count
+        response['X-DB-Time-Ms'] = profile.duration_ms
+        response['X-DB-Duplicate-Queries'] = profile.duplicates
+        return response
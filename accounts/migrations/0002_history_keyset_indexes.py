@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gameparticipation',
+            index=models.Index(fields=['user', 'joined_at', 'id'], name='game_partic_user_id_d61fa6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['created_at', 'id'], name='game_sessio_created_bc9cd8_idx'),
+        ),
+    ]
@@ -1,9 +1,10 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models
 from .managers import UserManager
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 import uuid
+from datetime import timedelta
 from django.conf import settings
 import random
 
@@ -32,6 +33,17 @@ class GameSessionManager(models.Manager):
             session = self.create_new_session()
         return session
 
+    def claim_session_end(self, session):
+        """Atomically mark the session as ended; returns False if it was already ended elsewhere"""
+        now = timezone.now()
+        claimed = self.filter(pk=session.pk, is_active=True).update(
+            is_active=False, end_time=now, updated_at=now
+        )
+        if claimed:
+            session.is_active = False
+            session.end_time = now
+        return bool(claimed)
+
     def create_new_session(self):
         session = self.create(
             is_active=True,
@@ -64,6 +76,7 @@ class GameSession(models.Model):
             models.Index(fields=['is_active']),
             models.Index(fields=['created_at']),
             models.Index(fields=['session_id']),
+            models.Index(fields=['created_at', 'id']),
         ]
         ordering = ['-created_at']
 
@@ -79,6 +92,11 @@ class GameSession(models.Model):
         remaining = settings.GAME_SESSION_DURATION - elapsed.total_seconds()
         return max(0, int(remaining))
 
+    @property
+    def deadline(self):
+        """Moment at which the session is due to end"""
+        return self.start_time + timedelta(seconds=settings.GAME_SESSION_DURATION)
+
     def end_session(self, winning_number):
         """End the session and set winning number"""
         self.is_active = False
@@ -87,6 +105,42 @@ class GameSession(models.Model):
         self.save()
 
 
+class GameParticipationManager(models.Manager):
+    def upsert(self, session, user_id, number=None):
+        """
+        Add the user to the session, or set their number if they already play
+        in it. Returns whether a new participation was created. The live player
+        count is kept in Redis (see accounts.counters) and stored at settlement.
+        """
+        connection = connections[self.db]
+        is_winner = bool(number and number == session.winning_number)
+        joined_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        participations = connection.ops.quote_name(self.model._meta.db_table)
+        insert = (
+            f'INSERT INTO {participations} (user_id, session_id, selected_number, is_winner, joined_at) '
+            f'VALUES (%s, %s, %s, %s, %s) ON CONFLICT (user_id, session_id)'
+        )
+        params = [user_id, session.pk, number, is_winner, joined_at]
+
+        if connection.vendor == 'postgresql' and number is not None:
+            # One statement: xmax = 0 only for a freshly inserted row
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'{insert} DO UPDATE SET selected_number = EXCLUDED.selected_number, '
+                    f'is_winner = EXCLUDED.is_winner RETURNING (xmax = 0)',
+                    params,
+                )
+                return cursor.fetchone()[0]
+
+        # Elsewhere a conflicting insert reports no row, and the pick is then set separately
+        with connection.cursor() as cursor:
+            cursor.execute(f'{insert} DO NOTHING', params)
+            created = cursor.rowcount == 1
+        if not created and number is not None:
+            self.filter(session=session, user_id=user_id).update(selected_number=number, is_winner=is_winner)
+        return created
+
+
 class GameParticipation(models.Model):
     """Model for tracking user participation in game sessions"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='game_participations')
@@ -99,6 +153,8 @@ class GameParticipation(models.Model):
     is_winner = models.BooleanField(default=False)
     joined_at = models.DateTimeField(auto_now_add=True)
 
+    objects = GameParticipationManager()
+
     class Meta:
         db_table = 'game_participations'
         unique_together = ['user', 'session']
@@ -106,15 +162,20 @@ class GameParticipation(models.Model):
             models.Index(fields=['user', 'session']),
             models.Index(fields=['is_winner']),
             models.Index(fields=['joined_at']),
+            models.Index(fields=['user', 'joined_at', 'id']),
         ]
 
     def __str__(self):
         return f"{self.user.username} in {self.session.session_id}"
 
 
+# Leaderboard order; the last column breaks ties the way the Redis sorted set does
+LEADERBOARD_ORDERING = ('-wins', '-games_played', '-best_streak', '-user_id')
+
+
 class UserGameStatsManager(models.Manager):
     def get_leaderboard(self, limit=10):
-        return self.order_by('-wins', '-games_played', '-best_streak')[:limit]
+        return self.order_by(*LEADERBOARD_ORDERING)[:limit]
 
 class UserGameStats(models.Model):
     """Extended user statistics for games"""
@@ -0,0 +1,82 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first pagination on `(ordering_field, id)`.
+
+    The cursor carries the key of the last row of a page, so every page is
+    one index range scan, however deep, and no COUNT query is needed.
+    """
+    ordering_field = None
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        field = self.ordering_field
+        queryset = queryset.order_by(f'-{field}', '-id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            # The redundant `<=` bound lets the database range-scan the composite index
+            queryset = queryset.filter(Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(id__lt=pk)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_key = (getattr(rows[-1], field), rows[-1].id) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(*self.next_key))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def encode_cursor(self, value, pk):
+        return urlsafe_b64encode(f'{value.isoformat()}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+            value, pk = parse_datetime(value), int(pk)
+        except (Base64Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+
+class SessionHistoryPagination(KeysetPagination):
+    ordering_field = 'created_at'
+    page_size = 20
+
+
+class GameHistoryPagination(KeysetPagination):
+    ordering_field = 'joined_at'
+    page_size = 50
@@ -0,0 +1,76 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from . import fastjson
+
+logger = logging.getLogger(__name__)
+
+_current_profile = ContextVar('query_profile', default=None)
+
+
+class QueryProfile:
+    """SQL statements executed while a profile is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+    @property
+    def duplicates(self):
+        """Statements that repeat an earlier one with the same SQL, the usual sign of an N+1"""
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_duplicated(self):
+        sql, count = next(iter(self.statements.most_common(1)), (None, 0))
+        return sql if count > 1 else None
+
+
+def profile_execute(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection when the profiler is enabled"""
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.duration += time.perf_counter() - started
+        profile.count += 1
+        profile.statements[sql] += 1
+
+
+@contextmanager
+def profile_queries():
+    """Collect the queries run by this context, including sync code it runs in threads"""
+    profile = QueryProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+@contextmanager
+def log_query_profile(event, **fields):
+    """Profile the block and log the result as one JSON line; a no-op unless the profiler is enabled"""
+    if not settings.QUERY_PROFILER_ENABLED:
+        yield None
+        return
+    with profile_queries() as profile:
+        yield profile
+    logger.info(fastjson.dumps_text({
+        'event': event,
+        **fields,
+        'queries': profile.count,
+        'db_ms': profile.duration_ms,
+        'duplicates': profile.duplicates,
+        'most_duplicated': profile.most_duplicated(),
+    }))
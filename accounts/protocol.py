@@ -0,0 +1,77 @@
+import time
+from datetime import datetime
+import msgpack
+from . import fastjson
+
+# Clients opt into the binary protocol through Sec-WebSocket-Protocol
+MSGPACK_SUBPROTOCOL = 'igame.msgpack'
+
+# Short integer codes replacing the 'type' string in binary frames
+MESSAGE_TYPES = {
+    # Server -> client
+    'session_info': 1,
+    'session_started': 2,
+    'session_ended': 3,
+    'game_result': 4,
+    'player_joined': 5,
+    'number_selected': 6,
+    'session_result': 7,
+    'session_snapshot': 8,
+    'session_countdown': 9,
+    'error': 10,
+    'game_session_manager_result': 11,
+    'end_session_and_create_new_result': 12,
+    'update_user_stats_result': 13,
+    'selection_histogram': 14,
+    'time_sync_result': 15,
+    'resume_result': 16,
+    # Client -> server
+    'join_session': 64,
+    'select_number': 65,
+    'get_snapshot': 66,
+    'leave_session': 67,
+    'trigger_game_session_manager': 68,
+    'trigger_end_session': 69,
+    'trigger_update_user_stats': 70,
+    'time_sync': 71,
+    'resume': 72,
+}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+
+def epoch_ms(moment=None):
+    """Milliseconds since the Unix epoch, the clock format of the protocol; now by default"""
+    if moment is None:
+        return int(time.time() * 1000)
+    return int(moment.timestamp() * 1000)
+
+
+def encode_text(message):
+    """JSON text frame"""
+    return fastjson.dumps_text(message)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def encode_binary(message):
+    """MessagePack frame with the message type replaced by its integer code"""
+    message = dict(message)
+    message['type'] = MESSAGE_TYPES.get(message['type'], message['type'])
+    return msgpack.packb(message, default=_msgpack_default)
+
+
+def decode_binary(data):
+    """Decode a MessagePack frame, mapping the integer type code back to its name"""
+    message = msgpack.unpackb(data, strict_map_key=False)
+    if not isinstance(message, dict):
+        raise ValueError('Binary frames must contain a map')
+    code = message.get('type')
+    if isinstance(code, int):
+        message['type'] = MESSAGE_NAMES.get(code, code)
+    elif code is not None and not isinstance(code, str):
+        raise ValueError('Message type must be a code or a name')
+    return message
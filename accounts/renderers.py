@@ -0,0 +1,28 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from . import fastjson
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON renderer backed by orjson"""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        return fastjson.dumps(data, indent=bool(renderer_context.get('indent')))
+
+
+class ORJSONParser(BaseParser):
+    """JSON parser backed by orjson"""
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return fastjson.loads(stream.read())
+        except fastjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
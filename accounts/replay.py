@@ -0,0 +1,56 @@
+from django.conf import settings
+from redis.exceptions import RedisError
+from . import fastjson
+from .utils import get_redis
+
+EVENT_SEQUENCE_KEY = 'game:events:seq'
+EVENT_BUFFER_KEY = 'game:events:buffer'
+
+# Assigns the next room event sequence number and keeps the event, scored by
+# it, in a sorted set trimmed to the newest ARGV[2] entries. Returns the number.
+RECORD_EVENT_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. '|' .. ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+return seq
+"""
+
+_record_script = None
+
+
+def record_event(message):
+    """
+    Give a room broadcast its sequence number and keep it for clients that
+    resume after a reconnect. Returns the number, or None if Redis is unavailable.
+    """
+    global _record_script
+    try:
+        if _record_script is None:
+            _record_script = get_redis().register_script(RECORD_EVENT_SCRIPT)
+        return _record_script(
+            keys=[EVENT_SEQUENCE_KEY, EVENT_BUFFER_KEY],
+            args=[fastjson.dumps(message), settings.GAME_EVENT_BUFFER_SIZE],
+        )
+    except (RedisError, NotImplementedError):
+        return None
+
+
+def events_since(last_seq):
+    """
+    Return `(current_seq, messages)` with the room events sent after `last_seq`,
+    oldest first. `messages` is None when they cannot all be replayed, because
+    they left the buffer or the sequence was reset; the client must then resync.
+    """
+    redis = get_redis()
+    with redis.pipeline() as pipe:
+        pipe.get(EVENT_SEQUENCE_KEY)
+        pipe.zrangebyscore(EVENT_BUFFER_KEY, f'({last_seq}', '+inf')
+        current_seq, entries = pipe.execute()
+    current_seq = int(current_seq or 0)
+    if last_seq > current_seq or len(entries) < current_seq - last_seq:
+        return current_seq, None
+    messages = []
+    for entry in entries:
+        seq, message = entry.split(b'|', 1)
+        messages.append({**fastjson.loads(message), 'seq': int(seq)})
+    return current_seq, messages
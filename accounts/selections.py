@@ -0,0 +1,96 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from .models import GameParticipation
+from .utils import get_redis
+
+
+# Moves the pending picks (KEYS[1]) to the flushing hash (KEYS[2]) and returns
+# them. Picks left there by a flush whose database write failed are kept, and
+# newer pending picks take precedence over them.
+TAKE_SELECTIONS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        local picks = redis.call('HGETALL', KEYS[1])
+        for i = 1, #picks, 2 do
+            redis.call('HSET', KEYS[2], picks[i], picks[i + 1])
+        end
+        redis.call('DEL', KEYS[1])
+    else
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+_take_script = None
+
+
+def selections_key(session_id):
+    return f'game:selections:{session_id}'
+
+
+def flushing_key_for(session_id):
+    """Picks taken by a flush, kept until its database transaction commits"""
+    return f'game:selections:{session_id}:flushing'
+
+
+def buffer_selection(session, user_id, number):
+    """
+    Record the user's pick for `session` in Redis instead of the database.
+    The last pick wins. Returns whether this was the user's first pick and
+    the number of users with a buffered pick. Redis errors are raised, for
+    the caller to write the pick through instead.
+    """
+    key = selections_key(session.pk)
+    with get_redis().pipeline(transaction=False) as pipe:
+        pipe.hset(key, user_id, number)
+        pipe.hlen(key)
+        pipe.expire(key, settings.GAME_SESSION_DURATION * 3)
+        created, buffered, _ = pipe.execute()
+    return bool(created), buffered
+
+
+def flush_selections(session):
+    """
+    Persist the buffered picks of `session` with one bulk insert for new
+    players and one UPDATE per picked number for existing ones.
+    Returns the number of participations created. Raises RedisError when
+    the picks cannot be read, so they are not settled as if never made.
+    """
+    global _take_script
+    pending_key, flushing_key = selections_key(session.pk), flushing_key_for(session.pk)
+    try:
+        if _take_script is None:
+            _take_script = get_redis().register_script(TAKE_SELECTIONS_SCRIPT)
+        picks = _take_script(keys=[pending_key, flushing_key], args=[settings.GAME_SESSION_DURATION * 3])
+    except NotImplementedError:
+        # The cache is not Redis, so nothing can have been buffered
+        return 0
+    if not picks:
+        return 0
+
+    picks = {int(user_id): int(number) for user_id, number in zip(picks[::2], picks[1::2])}
+    with transaction.atomic():
+        existing = set(
+            GameParticipation.objects.filter(session=session, user_id__in=picks).values_list('user_id', flat=True)
+        )
+        GameParticipation.objects.bulk_create(
+            [
+                GameParticipation(user_id=user_id, session=session, selected_number=number)
+                for user_id, number in picks.items() if user_id not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+        users_by_number = defaultdict(list)
+        for user_id in existing:
+            users_by_number[picks[user_id]].append(user_id)
+        for number, user_ids in users_by_number.items():
+            GameParticipation.objects.filter(session=session, user_id__in=user_ids).update(selected_number=number)
+
+        # The picks are only dropped from Redis once they are safely in the database
+        transaction.on_commit(lambda: get_redis().delete(flushing_key))
+
+    return len(picks) - len(existing)
@@ -156,18 +156,27 @@ class UserStatsSerializer(serializers.ModelSerializer):
         ]
 
 
-class GameSessionDetailSerializer2(serializers.ModelSerializer):
-    """Detailed serializer for game sessions"""
-    time_remaining = serializers.ReadOnlyField()
+class GameSessionSummarySerializer(serializers.ModelSerializer):
+    """Compact session representation nested in participation lists"""
 
     class Meta:
         model = GameSession
-        fields = '__all__'
+        fields = ['session_id', 'start_time', 'end_time', 'winning_number', 'is_active', 'player_count']
+
+
+class SessionParticipantSerializer(serializers.ModelSerializer):
+    """Participation inside a session, without repeating the session"""
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = GameParticipation
+        fields = ['username', 'selected_number', 'is_winner']
+
 
 class GameParticipationSerializer(serializers.ModelSerializer):
     """Serializer for game participation"""
     username = serializers.CharField(source='user.username', read_only=True)
-    session = GameSessionDetailSerializer2(read_only=True)
+    session = GameSessionSummarySerializer(read_only=True)
 
     class Meta:
         model = GameParticipation
@@ -176,7 +185,7 @@ class GameParticipationSerializer(serializers.ModelSerializer):
 
 class GameSessionSerializer(serializers.ModelSerializer):
     """Serializer for game sessions"""
-    participations = GameParticipationSerializer(many=True, read_only=True)
+    participations = SessionParticipantSerializer(many=True, read_only=True)
     time_remaining = serializers.ReadOnlyField()
     session_id = serializers.UUIDField(read_only=True)
 
@@ -190,7 +199,7 @@ class GameSessionSerializer(serializers.ModelSerializer):
 
 class GameSessionDetailSerializer(serializers.ModelSerializer):
     """Detailed serializer for game sessions"""
-    participations = GameParticipationSerializer(many=True, read_only=True)
+    participations = SessionParticipantSerializer(many=True, read_only=True)
     time_remaining = serializers.ReadOnlyField()
 
     class Meta:
@@ -198,6 +207,27 @@ class GameSessionDetailSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class OwnParticipationSerializer(serializers.ModelSerializer):
+    """The requesting user's own play in a session"""
+
+    class Meta:
+        model = GameParticipation
+        fields = ['selected_number', 'is_winner', 'joined_at']
+
+
+class SessionHistorySerializer(GameSessionSummarySerializer):
+    """Session summary with the requesting user's participation"""
+    your_participation = serializers.SerializerMethodField()
+
+    class Meta(GameSessionSummarySerializer.Meta):
+        fields = GameSessionSummarySerializer.Meta.fields + ['your_participation']
+
+    def get_your_participation(self, session):
+        # Prefetched by SessionHistoryView into `own_participations`
+        participations = session.own_participations
+        return OwnParticipationSerializer(participations[0]).data if participations else None
+
+
 class NumberSelectionSerializer(serializers.Serializer):
     """Serializer for number selection"""
     selected_number = serializers.IntegerField(min_value=1, max_value=10)
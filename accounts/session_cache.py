@@ -0,0 +1,182 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from redis.exceptions import RedisError, WatchError
+from .models import GameSession
+from .utils import get_redis
+
+CURRENT_SESSION_KEY = 'game:current_session'
+CURRENT_SESSION_EPOCH_KEY = 'game:current_session:epoch'
+
+# Concrete field order of GameSession, as expected by Model.from_db
+SNAPSHOT_FIELDS = ('id', 'session_id', 'start_time', 'end_time', 'winning_number', 'is_active', 'player_count')
+
+
+class _LocalSnapshot:
+    """Process-wide copy of the current session snapshot"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = None
+        self.values = None
+        self.expires_at = 0.0
+
+
+_local = _LocalSnapshot()
+
+
+def get_current_session():
+    """
+    Return the current active session, resolved from process memory first,
+    then from the Redis snapshot, and only from the database on a miss.
+    Each call returns a fresh model instance that is safe to modify.
+    """
+    now = time.monotonic()
+    with _local.lock:
+        values, expires_at = _local.values, _local.expires_at
+    if values is not None and now < expires_at:
+        return _build_session(values)
+
+    try:
+        epoch, values = _read_snapshot()
+    except (RedisError, NotImplementedError):
+        epoch, values = None, None
+
+    if values is None:
+        session = GameSession.objects.get_current_active_session()
+        if session is None:
+            return None
+        values = _snapshot_values(session)
+        if epoch is not None:
+            try:
+                if not _fill_snapshot(epoch, values):
+                    # Ended or replaced since the query; serve it to this caller only
+                    return _build_session(values)
+            except (RedisError, NotImplementedError):
+                epoch = None
+
+    _remember(epoch, values)
+    return _build_session(values)
+
+
+def publish_current_session(session):
+    """Make `session` the cached current session for every process"""
+    values = _snapshot_values(session)
+    try:
+        redis = get_redis()
+        with redis.pipeline() as pipe:
+            pipe.incr(CURRENT_SESSION_EPOCH_KEY)
+            pipe.delete(CURRENT_SESSION_KEY)
+            epoch = pipe.execute()[0]
+            pipe.hset(CURRENT_SESSION_KEY, mapping=_encode(epoch, values))
+            pipe.expire(CURRENT_SESSION_KEY, _snapshot_ttl())
+            pipe.execute()
+    except (RedisError, NotImplementedError):
+        epoch = None
+    _remember(epoch, values)
+
+
+def invalidate_current_session():
+    """Drop the cached current session everywhere, e.g. right after it has been ended"""
+    with _local.lock:
+        _local.values = None
+        _local.expires_at = 0.0
+    try:
+        redis = get_redis()
+        with redis.pipeline() as pipe:
+            pipe.incr(CURRENT_SESSION_EPOCH_KEY)
+            pipe.delete(CURRENT_SESSION_KEY)
+            pipe.execute()
+    except (RedisError, NotImplementedError):
+        pass
+
+
+def _read_snapshot():
+    """
+    Return `(epoch, values)` of the cached snapshot, or the current epoch and
+    None on a miss, so a refill can tell whether the session moved on meanwhile
+    """
+    with get_redis().pipeline(transaction=False) as pipe:
+        pipe.hgetall(CURRENT_SESSION_KEY)
+        pipe.get(CURRENT_SESSION_EPOCH_KEY)
+        data, epoch = pipe.execute()
+    if not data:
+        return int(epoch or 0), None
+    return _decode(data)
+
+
+def _fill_snapshot(epoch, values):
+    """
+    Store a snapshot read from the database, unless the session was published
+    or invalidated since `epoch` was read, before the query. Returns whether
+    the snapshot was stored.
+    """
+    redis = get_redis()
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(CURRENT_SESSION_KEY, CURRENT_SESSION_EPOCH_KEY)
+            if pipe.exists(CURRENT_SESSION_KEY) or int(pipe.get(CURRENT_SESSION_EPOCH_KEY) or 0) != epoch:
+                return False
+            pipe.multi()
+            pipe.hset(CURRENT_SESSION_KEY, mapping=_encode(epoch, values))
+            pipe.expire(CURRENT_SESSION_KEY, _snapshot_ttl())
+            pipe.execute()
+        except WatchError:
+            return False
+    return True
+
+
+def _remember(epoch, values):
+    """Keep the snapshot in process memory until the next check or the session deadline"""
+    now = time.monotonic()
+    deadline = values['start_time'] + timedelta(seconds=settings.GAME_SESSION_DURATION)
+    until_deadline = (deadline - timezone.now()).total_seconds()
+    with _local.lock:
+        if epoch is not None and _local.epoch is not None and epoch < _local.epoch:
+            return
+        _local.epoch = epoch
+        _local.values = values
+        _local.expires_at = now + min(settings.CURRENT_SESSION_CACHE_TTL, until_deadline)
+
+
+def _snapshot_ttl():
+    return settings.GAME_SESSION_DURATION * 3
+
+
+def _snapshot_values(session):
+    return {name: getattr(session, name) for name in SNAPSHOT_FIELDS}
+
+
+def _build_session(values):
+    return GameSession.from_db('default', SNAPSHOT_FIELDS, [values[name] for name in SNAPSHOT_FIELDS])
+
+
+def _encode(epoch, values):
+    return {
+        'epoch': epoch,
+        'id': values['id'],
+        'session_id': str(values['session_id']),
+        'start_time': values['start_time'].isoformat(),
+        'end_time': values['end_time'].isoformat() if values['end_time'] else '',
+        'winning_number': values['winning_number'] or '',
+        'is_active': int(values['is_active']),
+        'player_count': values['player_count'],
+    }
+
+
+def _decode(data):
+    data = {key.decode(): value.decode() for key, value in data.items()}
+    values = {
+        'id': int(data['id']),
+        'session_id': uuid.UUID(data['session_id']),
+        'start_time': parse_datetime(data['start_time']),
+        'end_time': parse_datetime(data['end_time']) if data['end_time'] else None,
+        'winning_number': int(data['winning_number']) if data['winning_number'] else None,
+        'is_active': data['is_active'] == '1',
+        'player_count': int(data['player_count']),
+    }
+    return int(data['epoch']), values
@@ -1,7 +1,11 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import UserGameStats
+from .profiling import profile_execute
+from .user_cache import invalidate_cached_user
 
 
 @receiver(post_save, sender=User)
@@ -16,4 +20,17 @@ def save_user_game_stats(sender, instance, **kwargs):
     """Save UserGameStats when user is saved"""
     if hasattr(instance, 'game_stats'):
         instance.game_stats.save()
-        
\ No newline at end of file
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Drop the cached authentication user whenever it changes or is deleted"""
+    invalidate_cached_user(instance)
+
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    """Let the query profiler see every statement of the new connection"""
+    if settings.QUERY_PROFILER_ENABLED and profile_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_execute)
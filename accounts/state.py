@@ -9,4 +9,6 @@ token_backend = TokenBackend(
     api_settings.ISSUER,
     api_settings.JWK_URL,
     api_settings.LEEWAY,
+    api_settings.VERIFIED_TOKEN_CACHE_SIZE,
+    api_settings.VERIFIED_TOKEN_CACHE_TTL,
 )
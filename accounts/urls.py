@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     CurrentSessionView, JoinSessionView, SelectNumberView,
     SessionStatusView, SessionHistoryView,
-    LeaderboardView, UserStatsView, GameHistoryView, LoginView, RegisterUserView
+    LeaderboardView, LeaderboardAroundMeView, UserStatsView, GameHistoryView, LoginView, RegisterUserView
 )
 
 urlpatterns = [
@@ -22,4 +22,5 @@ urlpatterns = [
     path('users/<int:user_id>/stats/', UserStatsView.as_view(), name='user_stats'),
     path('users/game-history/', GameHistoryView.as_view(), name='game_history'),
     path('leaderboard/top10/', LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/me/', LeaderboardAroundMeView.as_view(), name='leaderboard_around_me'),
 ]
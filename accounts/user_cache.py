@@ -0,0 +1,46 @@
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+from .jwtsetting import api_settings
+
+logger = logging.getLogger(__name__)
+
+# What a cache outage looks like through django_redis or a raw client
+CACHE_ERRORS = (ConnectionInterrupted, RedisError)
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """
+    Return the user identified by `user_id` (matched on USER_ID_FIELD), from
+    the cache when possible. Raises `DoesNotExist` like a regular lookup.
+    A cache outage only costs the cache hit.
+    """
+    key = user_cache_key(user_id)
+    try:
+        user = cache.get(key)
+    except CACHE_ERRORS:
+        logger.warning('User cache unavailable, loading user %s from the database', user_id)
+        return get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    if user is None:
+        user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        try:
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+        except CACHE_ERRORS:
+            logger.warning('User cache unavailable, user %s not cached', user_id)
+    return user
+
+
+def invalidate_cached_user(user):
+    """Drop the cached copy of `user`, e.g. after it was saved or deactivated"""
+    try:
+        cache.delete(user_cache_key(getattr(user, api_settings.USER_ID_FIELD)))
+    except CACHE_ERRORS:
+        # Nothing can be served from an unreachable cache; a stale copy expires with its TTL
+        logger.warning('User cache unavailable, cached user %s not invalidated', user.pk)
@@ -1,10 +1,20 @@
+import logging
 import random
+import time
 from calendar import timegm
 from datetime import datetime
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from django.utils.functional import lazy
 from django.utils.timezone import is_naive, make_aware, utc
-from .models import UserGameStats, GameSession
+from redis.exceptions import RedisError
+from .metrics import SESSION_PLAYERS, SESSION_SETTLEMENT_DURATION
+from .models import UserGameStats, GameSession, GameParticipation
+
+logger = logging.getLogger(__name__)
 
 
 def make_utc(dt):
@@ -32,6 +42,12 @@ def format_lazy(s, *args, **kwargs):
 format_lazy = lazy(format_lazy, str)
 
 
+def get_redis():
+    """Raw client for the Redis instance behind the default cache"""
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
+
+
 def get_or_create_user_stats(user):
     """Get or create user game statistics"""
     stats, created = UserGameStats.objects.get_or_create(user=user)
@@ -44,39 +60,104 @@ def end_current_session():
     if not session:
         return None
 
+    from .counters import clear_live_counts
+    from .session_cache import invalidate_current_session
     winning_number = session.winning_number
+    session.player_count = session.participations.count()
     session.end_session(winning_number)
+    invalidate_current_session()
+    clear_live_counts(session)
 
     # Determine winners and update stats
+    update_user_stats_for_session(session.id, winning_number)
     participations = session.participations.filter(selected_number=winning_number)
 
-    for participation in participations:
-        participation.is_winner = True
-        participation.save()
-
-        # Update user stats
-        stats = get_or_create_user_stats(participation.user)
-        stats.update_stats(is_winner=True)
-
-    # Update losers
-    losing_participations = session.participations.exclude(selected_number=winning_number)
-    for participation in losing_participations:
-        stats = get_or_create_user_stats(participation.user)
-        stats.update_stats(is_winner=False)
-
     return session, participations
 
 
 def create_new_session():
-    """Create a new game session"""
-    return GameSession.objects.create_new_session()
+    """Create a new game session and publish it as the current session"""
+    from .session_cache import publish_current_session
+    session = GameSession.objects.create_new_session()
+    publish_current_session(session)
+    return session
+
+
+def settle_and_rotate(session):
+    """
+    End the given session, settle its stats, broadcast the result and start the next session.
+    Returns None when the session was already ended by another manager.
+    """
+    from asgiref.sync import async_to_sync
+    from .broadcast import broadcast, send_to_users
+    from .counters import clear_live_counts
+    from .selections import flush_selections
+    from .protocol import epoch_ms
+    from .session_cache import invalidate_current_session
+
+    started = time.perf_counter()
+    # Persist buffered picks before the claim: if Redis fails here, the session stays
+    # active and the next attempt settles it with them
+    flush_selections(session)
+    if not GameSession.objects.claim_session_end(session):
+        return None
+    invalidate_current_session()
+    try:
+        # Picks buffered since, on a host whose clock is behind
+        flush_selections(session)
+    except RedisError:
+        logger.exception('Could not persist late buffered picks of session %s', session.session_id)
+
+    winning_number = session.winning_number
+    update_user_stats_for_session(session.id, winning_number)
+    results = list(session.participations.values_list('user_id', 'user__username', 'selected_number', 'is_winner'))
+    # The live counter in Redis is written back to the row once, now that the session is over
+    GameSession.objects.filter(pk=session.pk).update(player_count=len(results))
+    session.player_count = len(results)
+    clear_live_counts(session)
+    new_session = create_new_session()
+
+    # Everyone gets a compact aggregate; each player also gets their own result
+    winners = [username for _, username, _, is_winner in results if is_winner]
+    number_counts = {number: 0 for number in range(1, 11)}
+    for _, _, selected_number, _ in results:
+        if selected_number in number_counts:
+            number_counts[selected_number] += 1
+    broadcast('session_ended', {
+        'session_id': session.session_id,
+        'winning_number': winning_number,
+        'winner_count': len(winners),
+        'player_count': len(results),
+        'number_counts': number_counts,
+    })
+    # The next session is announced before the per-player results, whose
+    # one group_send per player would otherwise delay it as sessions grow
+    broadcast('session_started', {
+        'session_id': new_session.session_id,
+        'start_time': new_session.start_time,
+        'deadline': epoch_ms(new_session.deadline),
+    })
+    async_to_sync(send_to_users)('game_result', {
+        user_id: {
+            'session_id': session.session_id,
+            'winning_number': winning_number,
+            'selected_number': selected_number,
+            'is_winner': is_winner,
+        }
+        for user_id, _, selected_number, is_winner in results
+    })
+    SESSION_SETTLEMENT_DURATION.observe(time.perf_counter() - started)
+    SESSION_PLAYERS.observe(len(results))
+    return {
+        'session': new_session,
+        'ended_session_id': session.session_id,
+        'winning_number': winning_number,
+        'winners': winners,
+    }
 
 
 def game_session_manager():
     """Main function to manage game sessions - returns session info and time left"""
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    
     session = GameSession.objects.get_current_active_session()
     result = {}
 
@@ -87,32 +168,12 @@ def game_session_manager():
             result['time_left'] = time_remaining
         else:
             # End current session and create new one
-            winning_number = session.winning_number
-            session.end_session(winning_number)
-            winners = list(
-                session.participations.filter(
-                    selected_number=winning_number
-                ).values_list('user__username', flat=True)
-            )
-            participations = list(session.participations.values('user__username', 'selected_number', 'is_winner'))
-            update_user_stats_for_session(session.id, winning_number)
-            # Broadcast session ended to all clients
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                'game_room',
-                {
-                    'type': 'session_ended',
-                    'winning_number': winning_number,
-                    'winners': winners,
-                    'participations': participations,
-                }
-            )
-            new_session = create_new_session()
-            result['session'] = new_session
-            result['time_left'] = new_session.time_remaining
-            result['ended_session_id'] = str(session.session_id)
-            result['winning_number'] = winning_number
-            result['winners'] = winners
+            settled = settle_and_rotate(session)
+            if settled is None:
+                # Another manager settled it first; report the session it started
+                settled = {'session': GameSession.objects.get_or_create_current_active_session()}
+            result.update(settled)
+            result['time_left'] = settled['session'].time_remaining
     else:
         new_session = create_new_session()
         result['session'] = new_session
@@ -123,49 +184,58 @@ def game_session_manager():
 
 def end_session_and_create_new(session_id):
     """End current session and create new one, return info for frontend to broadcast"""
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
     try:
         session = GameSession.objects.get(id=session_id)
-        if not session.is_active:
-            return None  # Already ended
-        winning_number = session.winning_number
-        session.end_session(winning_number)
-        winners = list(
-            session.participations.filter(
-                selected_number=winning_number
-            ).values_list('user__username', flat=True)
-        )
-        # Update user stats
-        update_user_stats_for_session(session.id, winning_number)
-        # Optionally: broadcast game result via channel_layer if needed
-        new_session = create_new_session()
-        return {
-            'ended_session_id': str(session.session_id),
-            'winning_number': winning_number,
-            'winners': winners,
-            'new_session_id': str(new_session.session_id),
-            'new_session_start_time': new_session.start_time.isoformat(),
-        }
     except GameSession.DoesNotExist:
         return None
+    if not session.is_active:
+        return None  # Already ended
+    settled = settle_and_rotate(session)
+    if settled is None:
+        return None
+    new_session = settled.pop('session')
+    settled['new_session_id'] = new_session.session_id
+    settled['new_session_start_time'] = new_session.start_time
+    return settled
 
 
 def update_user_stats_for_session(session_id, winning_number):
-    """Update user statistics for a completed session"""
-    try:
-        session = GameSession.objects.get(id=session_id)
-        # Update winner stats
-        winner_participations = session.participations.filter(selected_number=winning_number)
-        for participation in winner_participations:
-            participation.is_winner = True
-            participation.save()
-            stats = get_or_create_user_stats(participation.user)
-            stats.update_stats(is_winner=True)
-        # Update loser stats
-        loser_participations = session.participations.exclude(selected_number=winning_number)
-        for participation in loser_participations:
-            stats = get_or_create_user_stats(participation.user)
-            stats.update_stats(is_winner=False)
-    except GameSession.DoesNotExist:
-        pass
+    """
+    Update user statistics for a completed session.
+    Runs a fixed number of set-based statements regardless of the number of players.
+    """
+    from .leaderboard import update_leaderboard_for_session
+    participations = GameParticipation.objects.filter(session_id=session_id)
+    winner_participations = participations.filter(selected_number=winning_number)
+    player_ids = participations.values('user_id')
+    winner_ids = winner_participations.values('user_id')
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Picks can change after a write-through set is_winner, so every row is recomputed
+        winner_participations.update(is_winner=True)
+        participations.exclude(selected_number=winning_number).filter(is_winner=True).update(is_winner=False)
+
+        # Make sure every player has a stats row before updating them in bulk
+        missing_ids = participations.filter(user__game_stats__isnull=True).values_list('user_id', flat=True)
+        UserGameStats.objects.bulk_create(
+            [UserGameStats(user_id=user_id) for user_id in missing_ids],
+            ignore_conflicts=True,
+        )
+
+        UserGameStats.objects.filter(user_id__in=winner_ids).update(
+            wins=F('wins') + 1,
+            games_played=F('games_played') + 1,
+            current_streak=F('current_streak') + 1,
+            best_streak=Greatest('best_streak', F('current_streak') + 1),
+            last_played=now,
+            updated_at=now,
+        )
+        UserGameStats.objects.filter(user_id__in=player_ids).exclude(user_id__in=winner_ids).update(
+            games_played=F('games_played') + 1,
+            current_streak=0,
+            last_played=now,
+            updated_at=now,
+        )
+
+    update_leaderboard_for_session(session_id)
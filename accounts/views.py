@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.http import HttpResponse
 from rest_framework import generics
 from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView
@@ -9,19 +10,29 @@ from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-from django.db.models import F
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.db.models import Prefetch, prefetch_related_objects
 from .models import GameSession, GameParticipation, UserGameStats
 from .serializers import (
-    GameSessionSerializer, NumberSelectionSerializer,
+    GameSessionSerializer, NumberSelectionSerializer, SessionHistorySerializer,
     UserStatsSerializer, LeaderboardSerializer, GameSessionDetailSerializer, GameParticipationSerializer
 )
+from redis.exceptions import RedisError
+from .counters import announce_join, count_participant, live_player_count, record_participant
+from .leaderboard import LeaderboardNotReady, get_around, get_around_from_db, get_top, ranked_stats
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from .pagination import GameHistoryPagination, SessionHistoryPagination
+from .selections import buffer_selection
+from .session_cache import get_current_session
 from .utils import get_or_create_user_stats
 
 auth_user: AbstractUser = get_user_model()
 
 
+def participants_prefetch():
+    """Load a session's participations together with their users in one query"""
+    return Prefetch('participations', queryset=GameParticipation.objects.select_related('user'))
+
+
 class LoginView(generics.GenericAPIView):
     """ Login endpoint """
 
@@ -71,13 +82,15 @@ class CurrentSessionView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        session = GameSession.objects.get_current_active_session()
+        session = get_current_session()
         if not session:
             return Response(
                 {'error': 'No active session found'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+        session.player_count = live_player_count(session)
+        prefetch_related_objects([session], participants_prefetch())
         serializer = GameSessionSerializer(session)
         return Response(serializer.data)
 
@@ -87,41 +100,25 @@ class JoinSessionView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        session = GameSession.objects.get_current_active_session()
+        session = get_current_session()
         if not session:
             return Response(
                 {'error': 'No active session available'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Check if user already joined this session
-        participation, created = GameParticipation.objects.get_or_create(
-            user=request.user,
-            session=session
-        )
-
-        if not created:
+        # Join in one atomic upsert; the player count is a live counter in Redis
+        if not GameParticipation.objects.upsert(session, request.user.id):
             return Response(
                 {'error': 'Already joined this session'},
                 status=status.HTTP_409_CONFLICT
             )
+        session.player_count = count_participant(session, request.user.id)
 
-        # Update player count
-        session.player_count = F('player_count') + 1
-        session.save()
-        session.refresh_from_db()
-
-        # Broadcast player joined
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'game_room',
-            {
-                'type': 'player_joined',
-                'username': request.user.username,
-                'player_count': session.player_count
-            }
-        )
+        # Announce the new player with the next coalesced player_joined broadcast
+        announce_join(session, request.user.username)
 
+        prefetch_related_objects([session], participants_prefetch())
         serializer = GameSessionSerializer(session)
         return Response({'success': True, 'session': serializer.data})
 
@@ -135,7 +132,7 @@ class SelectNumberView(APIView):
         if session_id:
             session = get_object_or_404(GameSession, session_id=session_id)
         else:
-            session = GameSession.objects.get_current_active_session()
+            session = get_current_session()
 
         if not session or not session.is_active:
             return Response(
@@ -154,25 +151,39 @@ class SelectNumberView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get or create participation
-        try:
-            participation = GameParticipation.objects.get(
-                user=request.user,
-                session=session
-            )
-        except GameParticipation.DoesNotExist:
+        selected_number = serializer.validated_data['selected_number']
+        participations = GameParticipation.objects.filter(user=request.user, session=session)
+        if settings.GAME_SELECTION_WRITE_BEHIND:
+            if not participations.exists():
+                return Response(
+                    {'error': 'You must join the session first'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                # Persisted in bulk when the session is settled
+                buffer_selection(session, request.user.id, selected_number)
+            except (RedisError, NotImplementedError):
+                # Without Redis the pick is written through below
+                pass
+            else:
+                record_participant(session, request.user.id, selected_number)
+                return Response({'success': True, 'selected_number': selected_number, 'buffered': True})
+
+        # Update selected number (allow changing until session ends)
+        joined = participations.update(
+            selected_number=selected_number,
+            is_winner=selected_number == session.winning_number,
+        )
+        if not joined:
             return Response(
                 {'error': 'You must join the session first'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Update selected number (allow changing until session ends)
-        participation.selected_number = serializer.validated_data['selected_number']
-        participation.save()
-
+        record_participant(session, request.user.id, selected_number)
         return Response({
             'success': True,
-            'selected_number': participation.selected_number
+            'selected_number': selected_number
         })
 
 
@@ -181,7 +192,11 @@ class SessionStatusView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, session_id):
-        session = get_object_or_404(GameSession, session_id=session_id)
+        session = get_object_or_404(
+            GameSession.objects.prefetch_related(participants_prefetch()), session_id=session_id
+        )
+        if session.is_active:
+            session.player_count = live_player_count(session)
         serializer = GameSessionDetailSerializer(session)
         return Response(serializer.data)
 
@@ -189,12 +204,18 @@ class SessionStatusView(APIView):
 class SessionHistoryView(ListAPIView):
     """Get user's game session history"""
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = GameSessionSerializer
+    serializer_class = SessionHistorySerializer
+    pagination_class = SessionHistoryPagination
 
     def get_queryset(self):
+        own_participations = Prefetch(
+            'participations',
+            queryset=GameParticipation.objects.filter(user=self.request.user),
+            to_attr='own_participations',
+        )
         return GameSession.objects.filter(
             participations__user=self.request.user
-        ).order_by('-created_at')[:20]
+        ).prefetch_related(own_participations)
 
 
 class LeaderboardView(ListAPIView):
@@ -203,11 +224,38 @@ class LeaderboardView(ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = UserGameStats.objects.get_leaderboard(limit=10)
-        # Add rank to each item
-        for idx, stats in enumerate(queryset, 1):
-            stats.rank = idx
-        return queryset
+        try:
+            return ranked_stats(get_top(limit=10))
+        except (RedisError, NotImplementedError, LeaderboardNotReady):
+            queryset = list(UserGameStats.objects.get_leaderboard(limit=10).select_related('user'))
+            # Add rank to each item
+            for idx, stats in enumerate(queryset, 1):
+                stats.rank = idx
+            return queryset
+
+
+class LeaderboardAroundMeView(APIView):
+    """Get the current user's rank and the players ranked around them"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            radius = min(max(int(request.query_params.get('radius', 5)), 0), 50)
+        except ValueError:
+            return Response({'error': 'radius must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            rank, entries = get_around(request.user.id, radius=radius)
+        except (RedisError, NotImplementedError, LeaderboardNotReady):
+            rank, entries = get_around_from_db(request.user.id, radius=radius)
+        if rank is None:
+            return Response(
+                {'error': 'No ranking yet, play a game first'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = LeaderboardSerializer(ranked_stats(entries), many=True)
+        return Response({'rank': rank, 'results': serializer.data})
 
 
 class UserStatsView(RetrieveAPIView):
@@ -226,12 +274,18 @@ class GameHistoryView(ListAPIView):
     """Get user's detailed game history"""
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = GameParticipationSerializer
+    pagination_class = GameHistoryPagination
 
     def get_queryset(self):
         return GameParticipation.objects.filter(
             user=self.request.user
-        ).order_by('-joined_at')[:50]
+        ).select_related('user', 'session')
 
 
 def index(request):
     return HttpResponse('Welcome to Igame Server API Page')
+
+
+def metrics(request):
+    """Metrics of this process in the Prometheus text format"""
+    return HttpResponse(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
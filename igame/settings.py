@@ -61,9 +61,14 @@ SPECTACULAR_SETTINGS = {
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'accounts.renderers.ORJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'accounts.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'accounts.jwtauth.JWTAuthentication',
     ),
@@ -73,6 +78,8 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'accounts.middleware.MetricsMiddleware',
+    'accounts.middleware.QueryProfilerMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -257,7 +264,30 @@ CACHES = {
 # Game specific settings
 GAME_SESSION_DURATION = 20  # seconds
 GAME_SESSION_BREAK = 3  # seconds between sessions
+GAME_ENGINE_LEASE = 6  # seconds a session engine stays leader without renewing
 MAX_PLAYERS_PER_SESSION = 100
+CURRENT_SESSION_CACHE_TTL = 1  # seconds a process trusts its cached current session
+AUTH_USER_CACHE_TTL = 60  # seconds an authenticated user is served from the cache
+GAME_ROOM_SHARDS = 8  # game_room is split into this many channel groups
+GAME_SELECTION_WRITE_BEHIND = False  # buffer number picks in Redis and persist them at settlement
+SELECTION_HISTOGRAM_INTERVAL = 1  # seconds between selection_histogram broadcasts of a session
+PLAYER_JOINED_FLUSH_WINDOW = 0.15  # seconds of joins batched into one player_joined broadcast
+PLAYER_JOINED_MAX_USERNAMES = 20  # most recent usernames listed in a player_joined broadcast
+GAME_EVENT_BUFFER_SIZE = 500  # recent room broadcasts kept for clients resuming after a reconnect
+
+# Count SQL queries per request (X-DB-* headers) and per socket message (log lines)
+QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER_ENABLED') == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'accounts': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
 
 # Rate limiting settings
 RATE_LIMIT_SETTINGS = {
@@ -16,6 +16,8 @@ urlpatterns = [
     path("redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
     # index page
     path('', views.index, name="index"),
+    # Prometheus metrics
+    path('metrics', views.metrics, name="metrics"),
     # Admin
     path('admin/', admin.site.urls),
     # Accounts